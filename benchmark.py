@@ -0,0 +1,361 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+import pandas as pd
+
+from recipe_stats import compute_statistics
+from streamlit_app import filter_recipes, iter_filter_recipes, load_recipe_data
+from utils import convert_to_minutes_extended, count_unique_vals, find_unique_vals
+
+
+CATALOGUE_SIZES = [2_000, 50_000, 500_000]
+PANTRY_SIZES = [5, 15, 50]
+MISSING_COUNTS = [0, 2, 5]
+
+
+def build_distribution(db_path="./data/standardised_recipes.db"):
+    """
+    Extracts the empirical distributions needed to synthesise realistic catalogues from the real recipe database.
+
+    Parameters:
+        db_path (str): Path to the SQLite database with standardised recipes.
+
+    Returns:
+        dict: Ingredient frequencies, recipe lengths, cuisine/course/time strings and their weights.
+    """
+    conn = sqlite3.connect(db_path)
+    df = pd.read_sql_query(
+        "SELECT cuisine, course, total_time, normalised_ingredients FROM recipes", conn
+    )
+    conn.close()
+
+    ingredient_lists = [
+        [ingredient.strip() for ingredient in entry.split(";")]
+        for entry in df["normalised_ingredients"]
+        if entry
+    ]
+    ingredient_counts = Counter(
+        ingredient for ingredients in ingredient_lists for ingredient in ingredients
+    )
+    cuisine_counts = Counter(df["cuisine"].dropna())
+    course_counts = Counter(df["course"].dropna())
+    time_counts = Counter(df["total_time"].dropna())
+
+    return {
+        "ingredients": list(ingredient_counts.keys()),
+        "ingredient_weights": list(ingredient_counts.values()),
+        "lengths": [len(ingredients) for ingredients in ingredient_lists],
+        "cuisines": list(cuisine_counts.keys()),
+        "cuisine_weights": list(cuisine_counts.values()),
+        "courses": list(course_counts.keys()),
+        "course_weights": list(course_counts.values()),
+        "times": list(time_counts.keys()),
+        "time_weights": list(time_counts.values()),
+    }
+
+
+def synthesise_catalogue(distribution, size, seed=0):
+    """
+    Generates a synthetic recipe catalogue whose ingredients, recipe lengths, cuisines,
+    courses and cooking times follow the distribution of the real database.
+
+    Parameters:
+        distribution (dict): Output of `build_distribution`.
+        size (int): Number of recipes to generate.
+        seed (int): Seed for the random number generator, so runs are reproducible.
+
+    Returns:
+        pd.DataFrame: A DataFrame with the same columns as the `recipes` table.
+    """
+    rng = random.Random(seed)
+    lengths = rng.choices(distribution["lengths"], k=size)
+    ingredients = distribution["ingredients"]
+    weights = distribution["ingredient_weights"]
+    times = rng.choices(distribution["times"], distribution["time_weights"], k=size)
+
+    return pd.DataFrame(
+        {
+            "title": [f"Recipe {i}" for i in range(size)],
+            "link": [f"https://example.com/recipe-{i}/" for i in range(size)],
+            "image_url": None,
+            "description": None,
+            "total_time": times,
+            "course": rng.choices(
+                distribution["courses"], distribution["course_weights"], k=size
+            ),
+            "cuisine": rng.choices(
+                distribution["cuisines"], distribution["cuisine_weights"], k=size
+            ),
+            "ingredients": None,
+            "calories": None,
+            "normalised_ingredients": [
+                "; ".join(rng.choices(ingredients, weights, k=length))
+                for length in lengths
+            ],
+            "total_time_minutes": [convert_to_minutes_extended(t) for t in times],
+        }
+    )
+
+
+def measure(func, repeat=3):
+    """
+    Times a callable and records its peak traced memory.
+
+    The timed runs are done without tracing so that tracemalloc does not distort the timings;
+    memory is measured on one additional, separate run.
+
+    Parameters:
+        func (callable): Function without arguments to benchmark.
+        repeat (int): Number of timed runs.
+
+    Returns:
+        dict: Minimum and median runtime in seconds and peak memory in MiB.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "peak_mib": peak / 2**20,
+    }
+
+
+def run_benchmarks(sizes, pantry_sizes, missing_counts, repeat=3, seed=0):
+    """
+    Runs every hot path against synthetic catalogues of the given sizes.
+
+    Parameters:
+        sizes (list): Catalogue sizes to generate.
+        pantry_sizes (list): Number of (most frequent) ingredients in the pantry.
+        missing_counts (list): Values of `missing_count` passed to `filter_recipes`.
+        repeat (int): Number of timed runs per benchmark.
+        seed (int): Seed for the catalogue generator.
+
+    Returns:
+        list: One dictionary per benchmark with its name, parameters and measurements.
+    """
+    distribution = build_distribution()
+    ranked_ingredients = [
+        ingredient
+        for ingredient, _ in sorted(
+            zip(distribution["ingredients"], distribution["ingredient_weights"]),
+            key=lambda pair: -pair[1],
+        )
+    ]
+    results = []
+
+    for size in sizes:
+        print(f"Synthesising catalogue of {size} recipes")
+        catalogue = synthesise_catalogue(distribution, size, seed=seed)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "recipes.db")
+            conn = sqlite3.connect(db_path)
+            catalogue.to_sql("recipes", conn, index=False)
+            conn.close()
+
+            results.append(
+                {
+                    "name": "load_recipe_data",
+                    "size": size,
+                    "params": {},
+                    **measure(lambda: load_recipe_data(db_path), repeat),
+                }
+            )
+            df = load_recipe_data(db_path)
+            # Timed in a single process and with one process per CPU, so the speed-up of the pool is
+            # visible on the machine the benchmark runs on
+            for processes in sorted({1, os.cpu_count() or 1}):
+                results.append(
+                    {
+                        "name": "compute_statistics",
+                        "size": size,
+                        "params": {"co_occurrence": False, "processes": processes},
+                        **measure(
+                            lambda: compute_statistics(
+                                db_path, processes=processes, co_occurrence=False
+                            ),
+                            repeat,
+                        ),
+                    }
+                )
+
+        for column in ["normalised_ingredients", "cuisine", "course"]:
+            results.append(
+                {
+                    "name": "count_unique_vals",
+                    "size": size,
+                    "params": {"column": column},
+                    **measure(lambda: count_unique_vals(df, column), repeat),
+                }
+            )
+        results.append(
+            {
+                "name": "find_unique_vals",
+                "size": size,
+                "params": {"column": "normalised_ingredients"},
+                **measure(
+                    lambda: find_unique_vals(catalogue, "normalised_ingredients"),
+                    repeat,
+                ),
+            }
+        )
+        results.append(
+            {
+                "name": "convert_to_minutes_extended",
+                "size": size,
+                "params": {},
+                **measure(
+                    lambda: [convert_to_minutes_extended(t) for t in catalogue["total_time"]],
+                    repeat,
+                ),
+            }
+        )
+
+        cuisines = distribution["cuisines"]
+        courses = list(count_unique_vals(df, "course").keys())
+        for pantry_size in pantry_sizes:
+            pantry = ranked_ingredients[:pantry_size]
+            for missing_count in missing_counts:
+                print(
+                    f"  filter_recipes: pantry={pantry_size}, missing_count={missing_count}"
+                )
+                results.append(
+                    {
+                        "name": "filter_recipes",
+                        "size": size,
+                        "params": {
+                            "pantry_size": pantry_size,
+                            "missing_count": missing_count,
+                        },
+                        **measure(
+                            lambda: filter_recipes(
+                                df, cuisines, courses, 10000, pantry, missing_count
+                            ),
+                            repeat,
+                        ),
+                    }
+                )
+                results.append(
+                    {
+                        "name": "iter_filter_recipes_first_batch",
+                        "size": size,
+                        "params": {
+                            "pantry_size": pantry_size,
+                            "missing_count": missing_count,
+                        },
+                        **measure(
+                            lambda: next(
+                                iter_filter_recipes(
+                                    df, cuisines, courses, 10000, pantry, missing_count
+                                )
+                            ),
+                            repeat,
+                        ),
+                    }
+                )
+
+    return results
+
+
+def environment_info():
+    """
+    Collects information that identifies the code and machine a benchmark run was made on.
+
+    Returns:
+        dict: Git commit, Python, pandas, platform and CPU count information.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare_results(baseline, current, threshold=1.1):
+    """
+    Prints the runtime ratio of every benchmark present in both runs and flags regressions.
+
+    Parameters:
+        baseline (dict): Previously saved benchmark output.
+        current (dict): Benchmark output of this run.
+        threshold (float): Ratio of median runtimes above which a benchmark counts as a regression.
+
+    Returns:
+        list: Keys of the benchmarks that regressed.
+    """
+
+    def key(result):
+        return (result["name"], result["size"], json.dumps(result["params"], sort_keys=True))
+
+    baseline_results = {key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        previous = baseline_results.get(key(result))
+        if previous is None:
+            continue
+        ratio = result["median_s"] / previous["median_s"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(key(result))
+        print(f"{key(result)}: {ratio:.2f}x{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the recipe loading, filtering and normalisation hot paths."
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=CATALOGUE_SIZES)
+    parser.add_argument("--pantry-sizes", type=int, nargs="+", default=PANTRY_SIZES)
+    parser.add_argument("--missing-counts", type=int, nargs="+", default=MISSING_COUNTS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Path to a previous benchmark output.")
+    args = parser.parse_args()
+
+    output = {
+        "environment": environment_info(),
+        "results": run_benchmarks(
+            args.sizes, args.pantry_sizes, args.missing_counts, args.repeat, args.seed
+        ),
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), output)
@@ -0,0 +1,367 @@
+import hashlib
+import random
+import re
+import sqlite3
+from array import array
+from collections import defaultdict
+
+from instrumentation import increment, timed
+
+
+# The LSH index is kept out of the recipe database, which the app loads and hashes
+INDEX_PATH = "./data/dedupe_index.db"
+
+NUM_PERMUTATIONS = 128
+NUM_BANDS = 32
+SIMILARITY_THRESHOLD = 0.85
+SEED = 1
+
+# Posts with different links are only merged if their ingredient sets are (nearly) identical, since
+# variants such as chicken and beef pad thai share most of their title and ingredients
+MIN_INGREDIENT_SIMILARITY = 0.95
+
+# Mersenne prime used for the universal hash family of the MinHash permutations
+_PRIME = (1 << 61) - 1
+
+# Title words that say nothing about the dish itself
+TITLE_STOP_WORDS = {
+    "a", "and", "authentic", "best", "easy", "homemade", "how", "in", "make",
+    "of", "quick", "recipe", "style", "the", "to", "with",
+}
+
+
+def _hash_token(token):
+    """
+    Hashes a token to a 61-bit integer that is stable between runs (unlike the built-in hash()).
+    """
+    digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % _PRIME
+
+
+def make_permutations(num_permutations=NUM_PERMUTATIONS, seed=SEED):
+    """
+    Creates the (a, b) coefficients of the hash functions h(x) = (a * x + b) mod p used as MinHash permutations.
+
+    Parameters:
+        num_permutations (int): Number of hash functions, i.e. the length of a signature.
+        seed (int): Seed for the coefficients. Signatures are only comparable if they use the same seed.
+
+    Returns:
+        list: A list of (a, b) tuples.
+    """
+    rng = random.Random(seed)
+    return [
+        (rng.randrange(1, _PRIME), rng.randrange(0, _PRIME))
+        for _ in range(num_permutations)
+    ]
+
+
+def recipe_tokens(title, ingredients):
+    """
+    Builds the feature set of a recipe from its normalised ingredient set and its title words and word pairs.
+    Non-Latin characters (e.g. the Chinese name in "Mapo Tofu (麻婆豆腐)") and filler words are dropped.
+
+    Parameters:
+        title (str): The recipe title.
+        ingredients (str): The normalised ingredients, separated by ";".
+
+    Returns:
+        set: The tokens of the recipe.
+    """
+    tokens = {
+        f"i:{ingredient.strip().lower()}"
+        for ingredient in (ingredients or "").split(";")
+        if ingredient.strip()
+    }
+    words = [
+        word
+        for word in re.sub(r"[^a-z\s]", " ", (title or "").lower()).split()
+        if word not in TITLE_STOP_WORDS
+    ]
+    tokens.update(f"t:{word}" for word in words)
+    tokens.update(f"t:{first} {second}" for first, second in zip(words, words[1:]))
+    return tokens
+
+
+def minhash_signature(tokens, permutations):
+    """
+    Computes the MinHash signature of a set of tokens. The fraction of equal positions in two signatures
+    estimates the Jaccard similarity of the two sets.
+
+    Parameters:
+        tokens (set): The tokens to hash.
+        permutations (list): Coefficients from `make_permutations`.
+
+    Returns:
+        list: The signature, one value per permutation.
+    """
+    hashes = [_hash_token(token) for token in tokens] or [0]
+    return [min((a * x + b) % _PRIME for x in hashes) for a, b in permutations]
+
+
+def band_keys(signature, num_bands=NUM_BANDS):
+    """
+    Splits a signature into bands and hashes each band into a bucket key.
+    Two recipes become duplicate candidates if they share a bucket in any band.
+
+    Parameters:
+        signature (list): A MinHash signature.
+        num_bands (int): Number of bands. Must divide the signature length.
+
+    Returns:
+        list: One integer bucket key per band.
+    """
+    rows = len(signature) // num_bands
+    keys = []
+    for band in range(num_bands):
+        values = array("Q", signature[band * rows : (band + 1) * rows]).tobytes()
+        digest = hashlib.blake2b(values, digest_size=8).digest()
+        # Keep the key within SQLite's signed 64-bit integer range
+        keys.append(int.from_bytes(digest, "little") >> 1)
+    return keys
+
+
+def similarity(signature1, signature2):
+    """
+    Estimates the Jaccard similarity of two recipes from their signatures.
+
+    Returns:
+        float: The fraction of equal signature positions.
+    """
+    return sum(v1 == v2 for v1, v2 in zip(signature1, signature2)) / len(signature1)
+
+
+def ingredient_similarity(ingredients1, ingredients2):
+    """
+    Computes the exact Jaccard similarity of the normalised ingredient sets of two recipes.
+
+    Parameters:
+        ingredients1 (str): Normalised ingredients of the first recipe, separated by ";".
+        ingredients2 (str): Normalised ingredients of the second recipe, separated by ";".
+
+    Returns:
+        float: The Jaccard similarity, 0 if both recipes have no ingredients.
+    """
+    set1, set2 = (
+        {ingredient.strip().lower() for ingredient in (ingredients or "").split(";")}
+        - {""}
+        for ingredients in (ingredients1, ingredients2)
+    )
+    union = set1 | set2
+    return len(set1 & set2) / len(union) if union else 0.0
+
+
+def _tags(value):
+    """
+    Splits a stored cuisine or course string into its tags.
+    """
+    return [tag.strip() for tag in (value or "").split(",") if tag.strip()]
+
+
+def _create_tables(conn, num_permutations, num_bands, seed):
+    """
+    Creates the tables holding the persistent LSH index (in the attached "lsh" database) and the duplicate
+    group columns, if they do not exist. Raises a ValueError if the index was built with different parameters.
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS lsh.minhash_signatures (recipe_id INTEGER PRIMARY KEY, signature BLOB)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS lsh.lsh_buckets (band INTEGER, bucket INTEGER, recipe_id INTEGER)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS lsh.idx_lsh_buckets ON lsh_buckets (band, bucket)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS lsh.lsh_params (name TEXT PRIMARY KEY, value INTEGER)"
+    )
+
+    params = {"num_permutations": num_permutations, "num_bands": num_bands, "seed": seed}
+    stored = dict(conn.execute("SELECT name, value FROM lsh.lsh_params").fetchall())
+    if stored and stored != params:
+        raise ValueError(
+            f"The LSH index was built with {stored}, not {params}. Delete the index file to rebuild it."
+        )
+    conn.executemany("INSERT OR IGNORE INTO lsh.lsh_params VALUES (?, ?)", params.items())
+
+    columns = [row[1] for row in conn.execute("PRAGMA main.table_info(recipes)")]
+    if "duplicate_group" not in columns:
+        # The recipes table was (re)created, e.g. by to_sql(if_exists="replace"), so the rowids in the
+        # index no longer refer to the same recipes
+        conn.execute("DELETE FROM lsh.minhash_signatures")
+        conn.execute("DELETE FROM lsh.lsh_buckets")
+        conn.execute("ALTER TABLE recipes ADD COLUMN duplicate_group INTEGER")
+    if "is_canonical" not in columns:
+        conn.execute("ALTER TABLE recipes ADD COLUMN is_canonical INTEGER DEFAULT 1")
+
+
+def merge_link_tags(conn):
+    """
+    Copies the cuisine and course tags of recipes scraped more than once (e.g. from several category
+    listings) onto the first row with the same link, so no tag is lost when the repeats are hidden.
+
+    Parameters:
+        conn (sqlite3.Connection): Connection to the recipe database.
+
+    Returns:
+        dict: link -> rowid of the first row with that link, for links that occur more than once.
+    """
+    rows_by_link = defaultdict(list)
+    for row in conn.execute("SELECT rowid, link, cuisine, course FROM recipes ORDER BY rowid"):
+        rows_by_link[row[1]].append(row)
+
+    first_rows = {}
+    for link, rows in rows_by_link.items():
+        if len(rows) == 1:
+            continue
+        first_rows[link] = rows[0][0]
+        cuisine, course = (
+            ", ".join(dict.fromkeys(tag for row in rows for tag in _tags(row[column])))
+            for column in (2, 3)
+        )
+        if (cuisine, course) != (rows[0][2], rows[0][3]):
+            conn.execute(
+                "UPDATE recipes SET cuisine = ?, course = ? WHERE rowid = ?",
+                (cuisine, course, rows[0][0]),
+            )
+    return first_rows
+
+
+@timed("dedupe_recipes")
+def dedupe_recipes(
+    db_path="./data/standardised_recipes.db",
+    index_path=INDEX_PATH,
+    threshold=SIMILARITY_THRESHOLD,
+    min_ingredient_similarity=MIN_INGREDIENT_SIMILARITY,
+    num_permutations=NUM_PERMUTATIONS,
+    num_bands=NUM_BANDS,
+    seed=SEED,
+):
+    """
+    Finds duplicate recipes and tags them with a duplicate group, in two passes:
+
+    1. Exact: rows with the same link are the same post scraped more than once. The first row keeps the
+       tags of all of them (see `merge_link_tags`) and the others are hidden.
+    2. Near-duplicate: posts with different links (e.g. the same recipe cross-posted on two blogs) are
+       duplicates if their estimated Jaccard similarity reaches `threshold`, their ingredient sets reach
+       `min_ingredient_similarity` and they have the same cuisine tags, so no cuisine loses a recipe.
+
+    Only recipes that are not yet in the LSH index are hashed, and they are compared against the recipes
+    that share an LSH bucket with them, so rerunning this after new recipes were added is incremental.
+    The first recipe of a group is its canonical recipe; `duplicate_group` holds the canonical recipe's
+    rowid and `is_canonical` is 0 for all other members of the group. Recipes are identified by their rowid
+    (links are not unique), so the database must not be VACUUMed once indexed. Deleting the index file
+    rebuilds it on the next run.
+
+    Parameters:
+        db_path (str): Path to the SQLite database with standardised recipes.
+        index_path (str): Path to the SQLite database holding the LSH index.
+        threshold (float): Minimum estimated Jaccard similarity for two recipes to be duplicates.
+        min_ingredient_similarity (float): Minimum Jaccard similarity of the two ingredient sets.
+        num_permutations (int): Length of the MinHash signatures.
+        num_bands (int): Number of LSH bands.
+        seed (int): Seed for the MinHash permutations.
+
+    Returns:
+        dict: The number of newly indexed recipes, of recipes tagged as near-duplicates and of repeated links.
+    """
+    permutations = make_permutations(num_permutations, seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute("ATTACH DATABASE ? AS lsh", (index_path,))
+    _create_tables(conn, num_permutations, num_bands, seed)
+    first_rows = merge_link_tags(conn)
+
+    # Repeated links are never indexed, only the first row of each link is
+    new_recipes = conn.execute(
+        """
+        SELECT rowid, title, normalised_ingredients, cuisine FROM recipes
+        WHERE rowid IN (SELECT MIN(rowid) FROM recipes GROUP BY link)
+        AND rowid NOT IN (SELECT recipe_id FROM lsh.minhash_signatures)
+        ORDER BY rowid
+        """
+    ).fetchall()
+
+    duplicates = 0
+    for recipe_id, title, ingredients, cuisine in new_recipes:
+        signature = minhash_signature(recipe_tokens(title, ingredients), permutations)
+        keys = band_keys(signature, num_bands)
+
+        # Candidates are the indexed recipes sharing at least one bucket
+        candidate_ids = set()
+        for band, key in enumerate(keys):
+            candidate_ids.update(
+                row[0]
+                for row in conn.execute(
+                    "SELECT recipe_id FROM lsh.lsh_buckets WHERE band = ? AND bucket = ?",
+                    (band, key),
+                )
+            )
+
+        best_match, best_similarity = None, threshold
+        for candidate_id in sorted(candidate_ids):
+            blob, candidate_ingredients, candidate_cuisine = conn.execute(
+                """
+                SELECT s.signature, r.normalised_ingredients, r.cuisine
+                FROM lsh.minhash_signatures s JOIN recipes r ON r.rowid = s.recipe_id
+                WHERE s.recipe_id = ?
+                """,
+                (candidate_id,),
+            ).fetchone()
+            candidate_similarity = similarity(signature, array("Q", blob))
+            if (
+                candidate_similarity >= best_similarity
+                and set(_tags(candidate_cuisine)) == set(_tags(cuisine))
+                and ingredient_similarity(ingredients, candidate_ingredients)
+                >= min_ingredient_similarity
+            ):
+                best_match, best_similarity = candidate_id, candidate_similarity
+
+        if best_match is None:
+            conn.execute(
+                "UPDATE recipes SET duplicate_group = ?, is_canonical = 1 WHERE rowid = ?",
+                (recipe_id, recipe_id),
+            )
+        else:
+            (group,) = conn.execute(
+                "SELECT duplicate_group FROM recipes WHERE rowid = ?", (best_match,)
+            ).fetchone()
+            conn.execute(
+                "UPDATE recipes SET duplicate_group = ?, is_canonical = 0 WHERE rowid = ?",
+                (group, recipe_id),
+            )
+            duplicates += 1
+
+        conn.execute(
+            "INSERT INTO lsh.minhash_signatures VALUES (?, ?)",
+            (recipe_id, array("Q", signature).tobytes()),
+        )
+        conn.executemany(
+            "INSERT INTO lsh.lsh_buckets VALUES (?, ?, ?)",
+            [(band, key, recipe_id) for band, key in enumerate(keys)],
+        )
+
+    # Repeated links join the group of their first row
+    repeats = 0
+    for link, first_row in first_rows.items():
+        repeats += conn.execute(
+            """
+            UPDATE recipes SET is_canonical = 0,
+                duplicate_group = (SELECT duplicate_group FROM recipes WHERE rowid = ?)
+            WHERE link = ? AND rowid != ?
+            """,
+            (first_row, link, first_row),
+        ).rowcount
+
+    conn.commit()
+    conn.close()
+
+    increment("recipes_deduplicated", duplicates + repeats)
+    return {"indexed": len(new_recipes), "duplicates": duplicates, "repeats": repeats}
+
+
+if __name__ == "__main__":
+    summary = dedupe_recipes()
+    print(
+        f"Indexed {summary['indexed']} new recipes, {summary['duplicates']} of them are near-duplicates; "
+        f"{summary['repeats']} rows repeat the link of another row"
+    )
@@ -0,0 +1,297 @@
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+
+# Instrumentation is opt-in: set RECIPE_METRICS=1 or call `enable()` at runtime for the whole process,
+# or use `collecting()` for the current thread only
+_enabled = os.environ.get("RECIPE_METRICS", "0") not in ("", "0")
+_local = threading.local()
+_lock = threading.Lock()
+_stages = defaultdict(lambda: {"count": 0, "sum": 0.0, "max": 0.0})
+_counters = defaultdict(int)
+
+
+def enable():
+    """
+    Turns on metric collection for the running process.
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """
+    Turns off metric collection for the running process. Collected metrics are kept.
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    """
+    Returns:
+        bool: Whether metrics are currently being collected, for the process or the current thread.
+    """
+    return _enabled or getattr(_local, "enabled", False)
+
+
+def debug_params_allowed():
+    """
+    The ?metrics=1 and ?profile=1 query parameters are only honoured when the operator allows them with
+    RECIPE_DEBUG_PARAMS=1, so that visitors cannot make the app profile itself or reveal its metrics.
+    The variable is read on every call.
+
+    Returns:
+        bool: Whether the debug query parameters may be honoured.
+    """
+    return os.environ.get("RECIPE_DEBUG_PARAMS", "0") not in ("", "0")
+
+
+@contextlib.contextmanager
+def collecting(enabled=True):
+    """
+    Collects metrics for the current thread only, e.g. for a single app session's run, without turning on
+    collection for the rest of the process. The collected metrics are added to the process-wide totals.
+
+    Parameters:
+        enabled (bool): Whether to collect metrics inside the block.
+
+    Example:
+        >>> with collecting(st.query_params.get("metrics") == "1"):
+        ...     main()
+    """
+    previous = getattr(_local, "enabled", False)
+    _local.enabled = enabled
+    try:
+        yield
+    finally:
+        _local.enabled = previous
+
+
+def reset():
+    """
+    Clears all collected timings and counters.
+    """
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+
+def record(stage, seconds):
+    """
+    Records a single timing for a stage.
+
+    Parameters:
+        stage (str): Name of the stage, e.g. "filter_recipes".
+        seconds (float): Duration of the stage in seconds.
+    """
+    with _lock:
+        stats = _stages[stage]
+        stats["count"] += 1
+        stats["sum"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+
+
+def increment(name, value=1):
+    """
+    Increments a counter, e.g. the number of pages fetched. Does nothing while instrumentation is disabled.
+
+    Parameters:
+        name (str): Name of the counter.
+        value (int): Amount to add to the counter.
+    """
+    if not is_enabled():
+        return
+    with _lock:
+        _counters[name] += value
+
+
+class Timer:
+    """
+    Times a stage, either as a context manager or as a function decorator.
+    While instrumentation is disabled the overhead is two flag checks.
+
+    Example:
+        >>> with timed("sqlite_load"):
+        ...     df = pd.read_sql_query(query, conn)
+        >>> @timed("filter_recipes")
+        ... def filter_recipes(...): ...
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter() if is_enabled() else None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._start is not None:
+            record(self.stage, time.perf_counter() - self._start)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_enabled():
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(self.stage, time.perf_counter() - start)
+
+        return wrapper
+
+
+def timed(stage):
+    """
+    Creates a `Timer` for a stage.
+
+    Parameters:
+        stage (str): Name of the stage.
+
+    Returns:
+        Timer: A timer usable with `with` or as a decorator.
+    """
+    return Timer(stage)
+
+
+def snapshot():
+    """
+    Returns a copy of all collected metrics.
+
+    Returns:
+        dict: Per-stage timing statistics (count, sum, mean and max in seconds) and counters.
+    """
+    with _lock:
+        stages = {
+            stage: {**stats, "mean": stats["sum"] / stats["count"]}
+            for stage, stats in _stages.items()
+            if stats["count"]
+        }
+        counters = dict(_counters)
+    return {"stages": stages, "counters": counters}
+
+
+def export_json():
+    """
+    Returns:
+        str: The collected metrics as a JSON document.
+    """
+    return json.dumps(snapshot(), indent=2, sort_keys=True)
+
+
+def export_prometheus():
+    """
+    Returns:
+        str: The collected metrics in the Prometheus text exposition format.
+    """
+    metrics = snapshot()
+    lines = [
+        "# HELP recipe_stage_seconds Time spent in each stage.",
+        "# TYPE recipe_stage_seconds summary",
+    ]
+    for stage, stats in sorted(metrics["stages"].items()):
+        lines.append(f'recipe_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines.append(f'recipe_stage_seconds_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+    lines += [
+        "# HELP recipe_stage_seconds_max Longest single run of each stage.",
+        "# TYPE recipe_stage_seconds_max gauge",
+    ]
+    for stage, stats in sorted(metrics["stages"].items()):
+        lines.append(f'recipe_stage_seconds_max{{stage="{stage}"}} {stats["max"]:.6f}')
+    lines += [
+        "# HELP recipe_events_total Number of events per counter.",
+        "# TYPE recipe_events_total counter",
+    ]
+    for name, value in sorted(metrics["counters"].items()):
+        lines.append(f'recipe_events_total{{name="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path=None):
+    """
+    Writes the collected metrics to a file. Files ending in ".prom" are written in the Prometheus
+    text format (e.g. for the node exporter's textfile collector), anything else as JSON.
+
+    Parameters:
+        path (str): Output path. Defaults to the RECIPE_METRICS_PATH environment variable.
+
+    Returns:
+        str or None: The path written to, or None if no path was configured.
+    """
+    path = path or os.environ.get("RECIPE_METRICS_PATH")
+    if not path:
+        return None
+
+    content = export_prometheus() if path.endswith(".prom") else export_json()
+    # Write to a unique temporary file in the same directory first, so readers never see a partially
+    # written file and concurrent writers never share one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+
+def start_profiler(profiler=None):
+    """
+    Starts profiling the current thread, e.g. for a single app run.
+
+    Parameters:
+        profiler (str): "cprofile" or "pyinstrument". Defaults to the RECIPE_PROFILER environment variable,
+                        or "cprofile". Falls back to cProfile if pyinstrument is not installed.
+
+    Returns:
+        object: The running profiler, to be passed to `stop_profiler`.
+    """
+    profiler = profiler or os.environ.get("RECIPE_PROFILER", "cprofile")
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+
+            running = Profiler()
+            running.start()
+            return running
+        except ImportError:
+            pass
+
+    running = cProfile.Profile()
+    running.enable()
+    return running
+
+
+def stop_profiler(running, limit=30):
+    """
+    Stops a profiler started with `start_profiler` and renders its report.
+
+    Parameters:
+        running (object): The profiler returned by `start_profiler`.
+        limit (int): Number of functions to include in a cProfile report.
+
+    Returns:
+        str: A text report, sorted by cumulative time for cProfile.
+    """
+    if isinstance(running, cProfile.Profile):
+        running.disable()
+        stream = io.StringIO()
+        pstats.Stats(running, stream=stream).sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+    running.stop()
+    return running.output_text()
@@ -0,0 +1,212 @@
+import re
+import sqlite3
+
+from instrumentation import timed
+from utils import convert_to_minutes_extended
+
+
+# Columns written by `parse_recipes` for the WP Recipe Maker nutrition labels (see `nutrition_column`)
+NUTRITION_COLUMNS = [
+    "calories_kcal",
+    "carbohydrates_g",
+    "protein_g",
+    "fat_g",
+    "saturated_fat_g",
+    "polyunsaturated_fat_g",
+    "monounsaturated_fat_g",
+    "trans_fat_g",
+    "cholesterol_g",
+    "sodium_g",
+    "potassium_g",
+    "fiber_g",
+    "sugar_g",
+    "vitamin_a_iu",
+    "vitamin_c_g",
+    "calcium_g",
+    "iron_g",
+]
+
+# Typed columns extracted at ingest, so recipes can be filtered numerically without parsing strings.
+# Only calories can be backfilled for recipes scraped before the other nutrition values were stored.
+NUMERIC_COLUMNS = NUTRITION_COLUMNS + [
+    "prep_time_minutes",
+    "cook_time_minutes",
+    "total_time_minutes",
+    "servings",
+]
+
+# Conversion factors to the unit each quantity is stored in
+UNIT_CONVERSIONS = {
+    "kcal": ("kcal", 1.0),
+    "cal": ("kcal", 1.0),  # Nutrition labels use "Calories" to mean kilocalories
+    "kj": ("kcal", 1 / 4.184),
+    "g": ("g", 1.0),
+    "mg": ("g", 1e-3),
+    "mcg": ("g", 1e-6),
+    "µg": ("g", 1e-6),
+    "iu": ("iu", 1.0),
+}
+
+
+def parse_quantity(value):
+    """
+    Splits a quantity string such as "1,250 kcal" or "12.5 mg" into its number and unit,
+    converting the unit to the one it is stored in (kcal for energy, grams for masses).
+
+    Parameters:
+        value (str): The quantity string.
+
+    Returns:
+        tuple: (float, str), or (None, None) if the string does not contain a number.
+
+    Example:
+        >>> parse_quantity("420 mg")
+        (0.42, 'g')
+    """
+    if not isinstance(value, str):
+        return None, None
+
+    match = re.search(r"(\d[\d,]*(?:\.\d+)?)\s*([a-zA-Zµ]*)", value)
+    if not match:
+        return None, None
+
+    number = float(match.group(1).replace(",", ""))
+    unit = match.group(2).lower()
+    if unit in UNIT_CONVERSIONS:
+        unit, factor = UNIT_CONVERSIONS[unit]
+        number *= factor
+    return number, unit
+
+
+def nutrition_column(label, unit):
+    """
+    Builds the name of the numeric column for a nutrition label, e.g. ("Saturated Fat:", "g") -> "saturated_fat_g".
+
+    Parameters:
+        label (str): The nutrition label as scraped.
+        unit (str): The normalised unit.
+
+    Returns:
+        str: The column name.
+    """
+    name = re.sub(r"[^a-z]+", "_", label.lower()).strip("_")
+    return f"{name}_{unit}" if unit else name
+
+
+def extract_time_minutes(soup, key):
+    """
+    Reads a time (e.g. prep, cook or total time) from the WP Recipe Maker markup used by all the food blogs,
+    which stores days, hours and minutes in separate elements.
+
+    Parameters:
+        soup (BeautifulSoup): The parsed recipe page.
+        key (str): The WP Recipe Maker time key, e.g. "prep", "cook" or "total".
+
+    Returns:
+        float or None: The time in minutes, or None if the recipe does not list it.
+    """
+    minutes = None
+    for unit, factor in [("days", 1440), ("hours", 60), ("minutes", 1)]:
+        block = soup.select_one(f".wprm-recipe-{key}_time-{unit}")
+        number, _ = parse_quantity(block.text) if block else (None, None)
+        if number is not None:
+            minutes = (minutes or 0) + number * factor
+    return minutes
+
+
+def extract_servings(soup):
+    """
+    Reads the number of servings from the WP Recipe Maker markup.
+
+    Parameters:
+        soup (BeautifulSoup): The parsed recipe page.
+
+    Returns:
+        float or None: The number of servings, or None if the recipe does not list it.
+    """
+    block = soup.select_one(".wprm-recipe-servings")
+    number, _ = parse_quantity(block.text) if block else (None, None)
+    return number
+
+
+def range_conditions(numeric_ranges):
+    """
+    Builds an SQL condition for range filters on the numeric columns.
+
+    Parameters:
+        numeric_ranges (dict): Column name -> (minimum, maximum). Either bound can be None.
+
+    Returns:
+        tuple: The condition string (empty if there are no bounds) and its parameters.
+    """
+    conditions = []
+    params = []
+    for column, (minimum, maximum) in numeric_ranges.items():
+        if column not in NUMERIC_COLUMNS:
+            raise ValueError(
+                f"Unknown numeric column {column!r}. Expected one of {NUMERIC_COLUMNS}."
+            )
+        if minimum is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(minimum)
+        if maximum is not None:
+            conditions.append(f"{column} <= ?")
+            params.append(maximum)
+    return " AND ".join(conditions), params
+
+
+@timed("store_numeric_fields")
+def store_numeric_fields(db_path="./data/standardised_recipes.db"):
+    """
+    Adds the numeric columns to a recipe database and indexes the ones that hold values. Values missing from
+    the numeric columns are backfilled from the text columns ("calories" and "total_time") where possible.
+
+    Parameters:
+        db_path (str): Path to the SQLite database.
+
+    Returns:
+        int: The number of rows that were backfilled.
+    """
+    conn = sqlite3.connect(db_path)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(recipes)")]
+    for column in NUMERIC_COLUMNS:
+        if column not in columns:
+            conn.execute(f"ALTER TABLE recipes ADD COLUMN {column} REAL")
+
+    rows = conn.execute(
+        """
+        SELECT rowid, calories, total_time, calories_kcal, total_time_minutes FROM recipes
+        WHERE calories_kcal IS NULL OR total_time_minutes IS NULL
+        """
+    ).fetchall()
+    updates = []
+    for rowid, calories, total_time, calories_kcal, total_time_minutes in rows:
+        if calories_kcal is None:
+            number, unit = parse_quantity(calories)
+            calories_kcal = number if unit == "kcal" else None
+        if total_time_minutes is None:
+            total_time_minutes = convert_to_minutes_extended(total_time)
+        updates.append((calories_kcal, total_time_minutes, rowid))
+    conn.executemany(
+        "UPDATE recipes SET calories_kcal = ?, total_time_minutes = ? WHERE rowid = ?",
+        updates,
+    )
+
+    # Only index the columns that hold values; the others stay NULL until the recipes are scraped again
+    for column in NUMERIC_COLUMNS:
+        populated = conn.execute(
+            f"SELECT 1 FROM recipes WHERE {column} IS NOT NULL LIMIT 1"
+        ).fetchone()
+        if populated:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_recipes_{column} ON recipes ({column})")
+        else:
+            conn.execute(f"DROP INDEX IF EXISTS idx_recipes_{column}")
+
+    conn.commit()
+    conn.close()
+    return len(updates)
+
+
+if __name__ == "__main__":
+    backfilled = store_numeric_fields()
+    print(f"Numeric columns stored, {backfilled} rows backfilled")
@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import time
+from collections import Counter
+
+from substitutions import SUBSTITUTION_GRAPH_PATH, load_substitution_graph
+from utils import dataset_version
+
+
+PRECOMPUTED_RESULTS_PATH = "./data/precomputed_results.json"
+
+# Set RECIPE_QUERY_LOG to a file path to log the queries made in the app
+QUERY_LOG_PATH = os.environ.get("RECIPE_QUERY_LOG")
+
+
+def query_key(
+    cuisines,
+    courses,
+    max_time,
+    ingredients,
+    missing_count,
+    substitutions=False,
+    numeric_ranges=None,
+):
+    """
+    Builds a canonical key for a query, so equal queries map to the same precomputed result
+    regardless of the order in which cuisines, courses or ingredients were selected.
+
+    Parameters:
+        cuisines (list): Selected cuisines.
+        courses (list): Selected courses.
+        max_time (int): Maximum cooking time in minutes.
+        ingredients (list): Ingredients the user has at home.
+        missing_count (int): Maximum number of missing ingredients.
+        substitutions (bool): Whether ingredient substitutions are allowed.
+        numeric_ranges (dict): Range filters on the numeric columns.
+
+    Returns:
+        str: The key of the query.
+    """
+    return json.dumps(
+        {
+            "cuisines": sorted(cuisines or []),
+            "courses": sorted(courses or []),
+            "max_time": max_time,
+            "ingredients": sorted(ingredients or []),
+            "missing_count": missing_count,
+            "substitutions": bool(substitutions),
+            "numeric_ranges": {
+                column: list(bounds)
+                for column, bounds in sorted((numeric_ranges or {}).items())
+            },
+        },
+        sort_keys=True,
+    )
+
+
+def results_version(
+    db_path="./data/standardised_recipes.db", graph_path=SUBSTITUTION_GRAPH_PATH
+):
+    """
+    Identifies the inputs the results of `filter_recipes` are computed from: the recipe database and the
+    substitution graph. Precomputed results are only valid while both are unchanged.
+
+    Parameters:
+        db_path (str): Path to the SQLite database the app loads.
+        graph_path (str): Path to the substitution graph the app loads.
+
+    Returns:
+        str: The versions of both files, joined by ":".
+    """
+    return ":".join(dataset_version(path) for path in (db_path, graph_path))
+
+
+def log_query(key, path=QUERY_LOG_PATH):
+    """
+    Appends a query to the query log, if one is configured.
+
+    Parameters:
+        key (str): The query key from `query_key`.
+        path (str): Path to the query log (one JSON object per line).
+    """
+    if not path:
+        return
+    with open(path, "a") as f:
+        f.write(json.dumps({"time": time.time(), "query": json.loads(key)}) + "\n")
+
+
+def load_precomputed(
+    db_path="./data/standardised_recipes.db",
+    path=PRECOMPUTED_RESULTS_PATH,
+    graph_path=SUBSTITUTION_GRAPH_PATH,
+):
+    """
+    Loads the precomputed results, if they were computed from the current database and substitution graph.
+
+    Parameters:
+        db_path (str): Path to the SQLite database the app loads.
+        path (str): Path to the precomputed results.
+        graph_path (str): Path to the substitution graph the app loads.
+
+    Returns:
+        dict: Query key -> (positions of recipes with all ingredients, positions of recipes with missing
+              ingredients) in the DataFrame returned by `load_recipe_data`. Empty if there are no results
+              for this dataset.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        precomputed = json.load(f)
+    if precomputed.get("version") != results_version(db_path, graph_path):
+        return {}
+    return {
+        result["key"]: (result["all"], result["missing"])
+        for result in precomputed["results"]
+    }
+
+
+def frequent_combinations(log_path, top_n):
+    """
+    Finds the most frequent (cuisines, courses) combinations in the query log, together with the
+    most common settings of the other filters for each combination.
+
+    Parameters:
+        log_path (str): Path to the query log.
+        top_n (int): Number of combinations to return.
+
+    Returns:
+        list: Queries (as dictionaries) for the most frequent combinations.
+    """
+    if not log_path or not os.path.exists(log_path):
+        return []
+
+    combinations = Counter()
+    settings = {}
+    with open(log_path) as f:
+        for line in f:
+            query = json.loads(line)["query"]
+            combination = (tuple(query["cuisines"]), tuple(query["courses"]))
+            combinations[combination] += 1
+            settings.setdefault(combination, Counter())[
+                (query["max_time"], query["missing_count"], query["substitutions"])
+            ] += 1
+
+    queries = []
+    for combination, _ in combinations.most_common(top_n):
+        (max_time, missing_count, substitutions), _ = settings[combination].most_common(1)[0]
+        queries.append(
+            {
+                "cuisines": list(combination[0]),
+                "courses": list(combination[1]),
+                "max_time": max_time,
+                "missing_count": missing_count,
+                "substitutions": substitutions,
+            }
+        )
+    return queries
+
+
+def materialise_results(
+    db_path="./data/standardised_recipes.db",
+    log_path=QUERY_LOG_PATH,
+    top_n=20,
+    path=PRECOMPUTED_RESULTS_PATH,
+    graph_path=SUBSTITUTION_GRAPH_PATH,
+):
+    """
+    Precomputes the results for the default pantry with the default filters, and for the most frequent
+    (cuisines, courses) combinations in the query log, and saves them with the version of their inputs.
+
+    With the default filters (no cuisine or course selected, a maximum cooking time of 0) no recipe matches,
+    so the default result is empty; it still spares new sessions a scan of the catalogue.
+
+    Parameters:
+        db_path (str): Path to the SQLite database the app loads.
+        log_path (str): Path to the query log.
+        top_n (int): Number of frequent combinations to precompute.
+        path (str): Output path.
+        graph_path (str): Path to the substitution graph.
+
+    Returns:
+        int: The number of precomputed queries.
+    """
+    # Imported here because the app itself imports this module
+    from streamlit_app import COMMON_INGREDIENTS, filter_recipes, load_recipe_data
+
+    df_recipes = load_recipe_data(db_path)
+    substitution_graph = load_substitution_graph(graph_path)
+
+    # The app's initial state: no pills selected, zero time and missing ingredients, substitutions on
+    queries = [
+        {
+            "cuisines": [],
+            "courses": [],
+            "max_time": 0,
+            "missing_count": 0,
+            "substitutions": True,
+        }
+    ] + frequent_combinations(log_path, top_n)
+
+    results = {}
+    for query in queries:
+        key = query_key(ingredients=COMMON_INGREDIENTS, **query)
+        if key in results:
+            continue
+        filtered_data, missing_data = filter_recipes(
+            df_recipes,
+            query["cuisines"],
+            query["courses"],
+            query["max_time"],
+            COMMON_INGREDIENTS,
+            query["missing_count"],
+            substitution_graph if query["substitutions"] else None,
+        )
+        # The app reads the results back with .iloc, so store row positions rather than index labels
+        results[key] = {
+            "key": key,
+            "all": df_recipes.index.get_indexer(filtered_data.index).tolist(),
+            "missing": df_recipes.index.get_indexer(missing_data.index).tolist(),
+        }
+
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "version": results_version(db_path, graph_path),
+                "results": list(results.values()),
+            },
+            f,
+        )
+    return len(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precompute the results of the default and most frequent queries."
+    )
+    parser.add_argument("--log", default=QUERY_LOG_PATH, help="Path to the query log.")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    count = materialise_results(log_path=args.log, top_n=args.top)
+    print(f"Precomputed {count} queries to {PRECOMPUTED_RESULTS_PATH}")
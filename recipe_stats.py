@@ -0,0 +1,333 @@
+import json
+import os
+import sqlite3
+import tempfile
+from collections import Counter
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, combinations
+
+from instrumentation import increment, timed
+from utils import dataset_version
+
+
+STATS_CACHE_PATH = "./data/recipe_stats.json"
+
+# Rows read from the database per chunk
+CHUNK_SIZE = 50_000
+
+# Below this many recipes, starting a process pool costs more than it saves
+PARALLEL_THRESHOLD = 200_000
+
+# Columns with a vocabulary, and the separator of the values in each
+VOCABULARY_COLUMNS = {"normalised_ingredients": ";", "cuisine": ",", "course": ","}
+
+# Chunks submitted to the process pool ahead of the one being merged, per worker
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+# In-memory cache, keyed by (database path, dataset version)
+_statistics = {}
+
+
+def _split(value, separator):
+    """
+    Splits a stored list into its stripped values, skipping empty entries.
+    """
+    if not value:
+        return []
+    return [item.strip() for item in value.split(separator) if item.strip()]
+
+
+def _empty_statistics(co_occurrence=True):
+    return {
+        "recipes": 0,
+        "frequencies": {column: Counter() for column in VOCABULARY_COLUMNS},
+        "co_occurrence": Counter() if co_occurrence else None,
+        "per_cuisine": {},
+    }
+
+
+def _first_appearance_order(entries, separator, vocabulary_size):
+    """
+    Lists the values of a chunk in order of first appearance. The rows are scanned in growing blocks, and
+    the scan stops as soon as all `vocabulary_size` values have been seen, which is usually early on.
+    """
+    order = {}
+    start, block = 0, 1_000
+    while len(order) < vocabulary_size and start < len(entries):
+        order.update(
+            dict.fromkeys(
+                map(
+                    str.strip,
+                    chain.from_iterable(
+                        entry.split(separator) for entry in entries[start : start + block]
+                    ),
+                )
+            )
+        )
+        order.pop("", None)
+        start += block
+        block *= 2
+    return list(order)
+
+
+def chunk_statistics(rows, co_occurrence=True):
+    """
+    Computes the statistics of one chunk of recipes. Chunks can be processed independently
+    (e.g. in separate processes) and combined with `merge_statistics`.
+
+    Recipes are grouped by their (few distinct) cuisine and course strings first, so ingredients are
+    counted with one bulk Counter per cuisine group instead of one update per recipe. The vocabularies
+    are then put back in order of first appearance in the chunk.
+
+    Parameters:
+        rows (list): (normalised_ingredients, cuisine, course) tuples as stored in the database.
+        co_occurrence (bool): Whether to count how often each pair of ingredients appears together.
+
+    Returns:
+        dict: Recipe count, value frequencies per column, ingredient pair co-occurrence counts (None if
+              not counted) and ingredient frequencies per cuisine.
+    """
+    stats = _empty_statistics(co_occurrence)
+    frequencies = stats["frequencies"]
+
+    entries = []
+    ingredients_by_cuisine = {}
+    for ingredients, cuisine, _ in rows:
+        if ingredients:
+            entries.append(ingredients)
+            ingredients_by_cuisine.setdefault(cuisine, []).append(ingredients)
+    course_strings = Counter(course for _, _, course in rows)
+    cuisine_strings = Counter(cuisine for _, cuisine, _ in rows)
+
+    separator = VOCABULARY_COLUMNS["normalised_ingredients"]
+    ingredient_counts = Counter()
+    for cuisine, group in ingredients_by_cuisine.items():
+        counts = Counter(
+            map(str.strip, chain.from_iterable(entry.split(separator) for entry in group))
+        )
+        counts.pop("", None)
+        ingredient_counts.update(counts)
+        for name in _split(cuisine, VOCABULARY_COLUMNS["cuisine"]):
+            stats["per_cuisine"].setdefault(name, Counter()).update(counts)
+    # The groups are counted in order of their cuisine string, not of the rows
+    frequencies["normalised_ingredients"] = Counter(
+        {
+            ingredient: ingredient_counts[ingredient]
+            for ingredient in _first_appearance_order(
+                entries, separator, len(ingredient_counts)
+            )
+        }
+    )
+
+    for column, strings in [("cuisine", cuisine_strings), ("course", course_strings)]:
+        for value, count in strings.items():
+            for name in _split(value, VOCABULARY_COLUMNS[column]):
+                frequencies[column][name] += count
+
+    if co_occurrence:
+        for ingredients, _, _ in rows:
+            stats["co_occurrence"].update(
+                combinations(sorted(set(_split(ingredients, separator))), 2)
+            )
+    stats["recipes"] = len(rows)
+    return stats
+
+
+def merge_statistics(total, partial):
+    """
+    Adds the statistics of a chunk to a running total, in place. Merging chunks in order keeps the
+    vocabularies in order of first appearance, as in `count_unique_vals`. The per-cuisine frequencies
+    are not ordered.
+
+    Parameters:
+        total (dict): The running total.
+        partial (dict): Statistics of one chunk.
+
+    Returns:
+        dict: The updated total.
+    """
+    total["recipes"] += partial["recipes"]
+    for column, counts in partial["frequencies"].items():
+        total["frequencies"][column].update(counts)
+    if partial["co_occurrence"] is not None:
+        total["co_occurrence"].update(partial["co_occurrence"])
+    for cuisine, counts in partial["per_cuisine"].items():
+        total["per_cuisine"].setdefault(cuisine, Counter()).update(counts)
+    return total
+
+
+def iter_chunks(db_path, chunk_size=CHUNK_SIZE):
+    """
+    Streams the recipes the app loads (skipping duplicates tagged by dedupe.py) from the database in chunks.
+
+    Parameters:
+        db_path (str): Path to the SQLite database.
+        chunk_size (int): Number of rows per chunk.
+
+    Yields:
+        list: (normalised_ingredients, cuisine, course) tuples.
+    """
+    conn = sqlite3.connect(db_path)
+    query = "SELECT normalised_ingredients, cuisine, course FROM recipes"
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(recipes)")]
+    if "is_canonical" in columns:
+        query += " WHERE is_canonical = 1"
+    cursor = conn.execute(query)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+    conn.close()
+
+
+@timed("compute_statistics")
+def compute_statistics(
+    db_path="./data/standardised_recipes.db",
+    chunk_size=CHUNK_SIZE,
+    processes=None,
+    co_occurrence=True,
+):
+    """
+    Computes vocabularies, frequencies, ingredient co-occurrence counts and per-cuisine ingredient
+    frequencies in a single streaming pass over the database. With a process pool, at most
+    CHUNKS_IN_FLIGHT_PER_WORKER chunks per worker are read ahead of the one being merged.
+
+    Parameters:
+        db_path (str): Path to the SQLite database.
+        chunk_size (int): Number of rows per chunk.
+        processes (int): Number of worker processes. Defaults to one per CPU for databases larger than
+                         PARALLEL_THRESHOLD recipes, and to no pool otherwise. 1 disables the pool.
+        co_occurrence (bool): Whether to count ingredient pairs, which dominates the runtime.
+
+    Returns:
+        dict: The statistics, see `chunk_statistics`.
+    """
+    if processes is None:
+        conn = sqlite3.connect(db_path)
+        (count,) = conn.execute("SELECT COUNT(*) FROM recipes").fetchone()
+        conn.close()
+        processes = os.cpu_count() if count > PARALLEL_THRESHOLD else 1
+
+    total = _empty_statistics(co_occurrence)
+    chunks = iter_chunks(db_path, chunk_size)
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            # Merged in submission order, which keeps the vocabularies in order of first appearance
+            pending = deque()
+            for rows in chunks:
+                pending.append(executor.submit(chunk_statistics, rows, co_occurrence))
+                if len(pending) >= processes * CHUNKS_IN_FLIGHT_PER_WORKER:
+                    merge_statistics(total, pending.popleft().result())
+            while pending:
+                merge_statistics(total, pending.popleft().result())
+    else:
+        for rows in chunks:
+            merge_statistics(total, chunk_statistics(rows, co_occurrence))
+    return total
+
+
+def _to_json(stats):
+    return {
+        "recipes": stats["recipes"],
+        "frequencies": {
+            column: list(counts.items())
+            for column, counts in stats["frequencies"].items()
+        },
+        "co_occurrence": (
+            None
+            if stats["co_occurrence"] is None
+            else [[a, b, count] for (a, b), count in stats["co_occurrence"].items()]
+        ),
+        "per_cuisine": {
+            cuisine: list(counts.items())
+            for cuisine, counts in stats["per_cuisine"].items()
+        },
+    }
+
+
+def _from_json(data):
+    return {
+        "recipes": data["recipes"],
+        "frequencies": {
+            column: Counter(dict(items)) for column, items in data["frequencies"].items()
+        },
+        "co_occurrence": (
+            None
+            if data["co_occurrence"] is None
+            else Counter({(a, b): count for a, b, count in data["co_occurrence"]})
+        ),
+        "per_cuisine": {
+            cuisine: Counter(dict(items)) for cuisine, items in data["per_cuisine"].items()
+        },
+    }
+
+
+def save_statistics(stats, version, cache_path=STATS_CACHE_PATH):
+    """
+    Saves statistics to the cache file together with the dataset version they were computed from.
+
+    Parameters:
+        stats (dict): The statistics, see `chunk_statistics`.
+        version (str): The dataset version from `dataset_version`.
+        cache_path (str): Path to the JSON cache file.
+    """
+    # Write to a unique temporary file in the same directory first, so a crash or a concurrent writer never
+    # leaves a truncated cache behind
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump({"dataset_version": version, "statistics": _to_json(stats)}, f)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def get_statistics(
+    db_path="./data/standardised_recipes.db",
+    cache_path=STATS_CACHE_PATH,
+    co_occurrence=False,
+):
+    """
+    Returns the statistics of a database, computing them only once per dataset version. Statistics are
+    cached in memory and in `cache_path`, so they are never recomputed per request.
+
+    Counting ingredient pairs dominates the runtime, so co-occurrence counts are only computed when they
+    are asked for; cached statistics without them are still used by callers that do not need them.
+
+    Parameters:
+        db_path (str): Path to the SQLite database.
+        cache_path (str): Path to the JSON file the statistics are cached in.
+        co_occurrence (bool): Whether the ingredient pair co-occurrence counts are needed.
+
+    Returns:
+        dict: The statistics, see `chunk_statistics`.
+    """
+    version = dataset_version(db_path)
+    key = (os.path.abspath(db_path), version)
+    stats = _statistics.get(key)
+
+    if stats is None and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached["dataset_version"] == version:
+                stats = _from_json(cached["statistics"])
+        except (json.JSONDecodeError, KeyError):
+            # E.g. a truncated or old-format cache file; it is recomputed and overwritten below
+            increment("stats_cache_errors")
+
+    if stats is None or (co_occurrence and stats["co_occurrence"] is None):
+        stats = compute_statistics(db_path, co_occurrence=co_occurrence)
+        save_statistics(stats, version, cache_path)
+
+    _statistics[key] = stats
+    return stats
+
+
+if __name__ == "__main__":
+    statistics = compute_statistics()
+    save_statistics(statistics, dataset_version("./data/standardised_recipes.db"))
+    print(f"Statistics of {statistics['recipes']} recipes saved to {STATS_CACHE_PATH}")
@@ -1,25 +1,50 @@
 import sqlite3
-from scraping_utils import scrape_recipes, generate_urls, parse_recipes
+import sys
+from scraping_utils import (
+    scrape_recipes,
+    generate_urls,
+    parse_recipes,
+    discover_recipes,
+    load_lastmods,
+    merge_with_existing,
+    save_rejected_links,
+)
 import os
 
 
 if __name__ == "__main__":
+    # Get the path to the main directory (one level up from the current script)
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
-    # Generate a list of urls which are the pages on which recipe cards are displayed
-    all_urls = generate_urls(
-        base_url="https://www.justonecookbook.com/recipes/page/{}/", pages=19
-    )
+    # Construct the path to the database file
+    db_path = os.path.join(base_dir, "data", "japanese_recipes.db")
 
-    # Generates a list of all recipe urls found on the food blog
-    recipes = scrape_recipes(
-        all_urls=all_urls,
-        recipe_card_selector="article.post-filter.post-sm.post-abbr",
-        title_selector="h3.article-title",
-        image_selector="img",
-        image_attr="src",
-    )
+    if "--listing" in sys.argv:
+        # Generate a list of urls which are the pages on which recipe cards are displayed
+        all_urls = generate_urls(
+            base_url="https://www.justonecookbook.com/recipes/page/{}/", pages=19
+        )
+
+        # Generates a list of all recipe urls found on the food blog
+        recipes = scrape_recipes(
+            all_urls=all_urls,
+            recipe_card_selector="article.post-filter.post-sm.post-abbr",
+            title_selector="h3.article-title",
+            image_selector="img",
+            image_attr="src",
+        )
+    else:
+        # Discover new or changed recipes from the blog's sitemap instead of crawling its listing pages
+        recipes = discover_recipes(
+            feed_url="https://www.justonecookbook.com/sitemap_index.xml",
+            # Only post permalinks; posts without a recipe card are rejected by parse_recipes
+            url_pattern=r"^https://www\.justonecookbook\.com/[^/?#]+/$",
+            sitemap_pattern="post",
+            known=load_lastmods(db_path),
+        )
 
     # Create a dataframe to store the metadata for each recipe
+    rejected = []
     df_japanese_recipes = parse_recipes(
         recipes=recipes,
         title_selector="h2.wprm-recipe-name.wprm-block-text-bold",
@@ -30,6 +55,7 @@ if __name__ == "__main__":
         nutrition_selector="span.wprm-nutrition-label-text-nutrition-container",
         instructions_selector="div.wprm-recipe-instructions-container",
         check_recipe_exists=("span.jump-text", "Jump to Recipe"),
+        rejected=rejected,
     )
 
     # Convert lists to strings so df can be stored in sql db
@@ -38,11 +64,9 @@ if __name__ == "__main__":
             lambda x: "; ".join(x) if isinstance(x, list) else x
         )
 
-    # Get the path to the main directory (one level up from the current script)
-    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-
-    # Construct the path to the database file
-    db_path = os.path.join(base_dir, "data", "japanese_recipes.db")
+    # Keep the recipes that did not change since the previous run
+    if "--listing" not in sys.argv:
+        df_japanese_recipes = merge_with_existing(df_japanese_recipes, db_path)
 
     # Connect to SQLite database (or create it if it doesn't exist)
     conn = sqlite3.connect(db_path)
@@ -53,4 +77,8 @@ if __name__ == "__main__":
     # Close the connection
     conn.close()
 
+    # Remember the posts without a recipe, so incremental runs only fetch them again once they change
+    if "--listing" not in sys.argv:
+        save_rejected_links(db_path, rejected)
+
     print("Data saved to database!")
@@ -1,37 +1,62 @@
 import sqlite3
-from scraping_utils import scrape_recipes, generate_urls, parse_recipes
+import sys
+from scraping_utils import (
+    scrape_recipes,
+    generate_urls,
+    parse_recipes,
+    discover_recipes,
+    load_lastmods,
+    merge_with_existing,
+    save_rejected_links,
+)
 import os
 
 
 if __name__ == "__main__":
+    # Get the path to the main directory (one level up from the current script)
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+    # Construct the path to the database file
+    db_path = os.path.join(base_dir, "data", "korean_recipes.db")
 
-    categories = [
-        "soups-guk-and-stews-jjigae/",
-        "appetizer-2/",
-        "salads/",
-        "main-dishes/",
-        "side-dishes/",
-        "desserts/",
-    ]
-    pages_per_category = [3, 2, 2, 5, 5, 3]
+    if "--listing" in sys.argv:
+        categories = [
+            "soups-guk-and-stews-jjigae/",
+            "appetizer-2/",
+            "salads/",
+            "main-dishes/",
+            "side-dishes/",
+            "desserts/",
+        ]
+        pages_per_category = [3, 2, 2, 5, 5, 3]
 
-    # Generate a list of urls which are the pages on which recipe cards are displayed
-    all_urls = generate_urls(
-        base_url="https://kimchimari.com/category/{}/page/{}/",
-        categories=categories,
-        pages_per_category=pages_per_category,
-    )
+        # Generate a list of urls which are the pages on which recipe cards are displayed
+        all_urls = generate_urls(
+            base_url="https://kimchimari.com/category/{}/page/{}/",
+            categories=categories,
+            pages_per_category=pages_per_category,
+        )
 
-    # Generates a list of all recipe urls found on the food blog
-    recipes = scrape_recipes(
-        all_urls=all_urls,
-        recipe_card_selector="article.status-publish",
-        title_selector="h2.entry-title",
-        image_selector="img",
-        image_attr="data-lazy-src",  # Default to "data-lazy-src" but handle "src" fallback
-    )
+        # Generates a list of all recipe urls found on the food blog
+        recipes = scrape_recipes(
+            all_urls=all_urls,
+            recipe_card_selector="article.status-publish",
+            title_selector="h2.entry-title",
+            image_selector="img",
+            image_attr="data-lazy-src",  # Default to "data-lazy-src" but handle "src" fallback
+        )
+    else:
+        # Discover new or changed recipes from the blog's sitemap instead of crawling its listing pages
+        recipes = discover_recipes(
+            feed_url="https://kimchimari.com/sitemap_index.xml",
+            # Only post permalinks; posts without a recipe card are rejected by parse_recipes
+            url_pattern=r"^https://kimchimari\.com/[^/?#]+/$",
+            sitemap_pattern="post",
+            known=load_lastmods(db_path),
+        )
 
     # Create a dataframe to store the metadata for each recipe
+    rejected = []
     df_korean_recipes = parse_recipes(
         recipes=recipes,
         title_selector="h2.wprm-recipe-name",
@@ -42,6 +67,7 @@ if __name__ == "__main__":
         nutrition_selector="span.wprm-nutrition-label-text-nutrition-container",
         instructions_selector="ul.wprm-recipe-instructions",
         check_recipe_exists=("a.wprm-recipe-jump", None),  # Check for valid recipes
+        rejected=rejected,
     )
     # Convert lists to strings so df can be stored in sql db
     if "ingredients" in df_korean_recipes.columns:
@@ -49,11 +75,9 @@ if __name__ == "__main__":
             lambda x: "; ".join(x) if isinstance(x, list) else x
         )
 
-    # Get the path to the main directory (one level up from the current script)
-    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-
-    # Construct the path to the database file
-    db_path = os.path.join(base_dir, "data", "korean_recipes.db")
+    # Keep the recipes that did not change since the previous run
+    if "--listing" not in sys.argv:
+        df_korean_recipes = merge_with_existing(df_korean_recipes, db_path)
 
     # Connect to SQLite database (or create it if it doesn't exist)
     conn = sqlite3.connect(db_path)
@@ -64,4 +88,8 @@ if __name__ == "__main__":
     # Close the connection
     conn.close()
 
+    # Remember the posts without a recipe, so incremental runs only fetch them again once they change
+    if "--listing" not in sys.argv:
+        save_rejected_links(db_path, rejected)
+
     print("Data saved to database!")
@@ -1,7 +1,23 @@
+import json
+import os
+import re
+import sqlite3
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
 import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 
+from instrumentation import increment, timed
+from numeric_fields import (
+    extract_servings,
+    extract_time_minutes,
+    nutrition_column,
+    parse_quantity,
+)
+
 
 def generate_urls(base_url=None, pages=None, categories=None, pages_per_category=None):
     """
@@ -36,6 +52,266 @@ def generate_urls(base_url=None, pages=None, categories=None, pages_per_category
     return urls
 
 
+def _local_name(tag):
+    """
+    Strips the XML namespace from a tag, e.g. "{http://www.sitemaps.org/schemas/sitemap/0.9}url" -> "url".
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+def normalise_date(value):
+    """
+    Converts a sitemap (W3C datetime) or RSS (RFC 822) date into an ISO 8601 string in UTC,
+    so dates from any source can be compared as strings.
+
+    Parameters:
+        value (str): The date string.
+
+    Returns:
+        str or None: The normalised date, or None if it could not be parsed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.astimezone(timezone.utc).isoformat()
+
+
+def _parse_xml_entry(elem):
+    """
+    Extracts the link, last modification date and image from a sitemap <url>/<sitemap>,
+    RSS <item> or Atom <entry> element.
+    """
+    entry = {"link": None, "lastmod": None}
+    for child in elem:
+        name = _local_name(child.tag)
+        if name == "loc" or (name == "link" and child.text and child.text.strip()):
+            entry["link"] = child.text.strip()
+        elif (
+            name == "link"
+            and child.get("href")
+            and child.get("rel", "alternate") == "alternate"
+        ):
+            entry["link"] = child.get("href")
+        elif name in ("lastmod", "pubDate", "updated") or (
+            name == "published" and not entry["lastmod"]
+        ):
+            entry["lastmod"] = normalise_date(child.text)
+        elif name == "image":
+            image_loc = [c for c in child if _local_name(c.tag) == "loc"]
+            if image_loc and "image_url" not in entry:
+                entry["image_url"] = image_loc[0].text.strip()
+    return entry
+
+
+def iter_feed_entries(chunks):
+    """
+    Incrementally parses an XML sitemap, sitemap index, RSS or Atom feed, or a JSON feed.
+    XML is parsed chunk by chunk and every element is released once read, so large sitemaps
+    never have to be held in memory.
+
+    Parameters:
+        chunks (iterable): The document as an iterable of byte chunks, e.g. `response.iter_content()`.
+
+    Yields:
+        tuple: (kind, entry) where kind is "sitemap" for entries of a sitemap index and "page" otherwise,
+               and entry is a dictionary with "link", "lastmod" and optionally "image_url".
+    """
+    chunks = iter(chunks)
+    first = b""
+    for chunk in chunks:
+        first += chunk
+        if first.strip():
+            break
+
+    # JSON feeds (https://jsonfeed.org) are small, so they are parsed in one go
+    if first.lstrip().startswith(b"{"):
+        feed = json.loads(first + b"".join(chunks))
+        for item in feed.get("items", []):
+            yield "page", {
+                "link": item.get("url"),
+                "lastmod": normalise_date(
+                    item.get("date_modified") or item.get("date_published")
+                ),
+                **({"image_url": item["image"]} if item.get("image") else {}),
+            }
+        return
+
+    parser = ET.XMLPullParser(events=("end",))
+    parser.feed(first)
+    for chunk in chunks:
+        for _, elem in parser.read_events():
+            yield from _entry_event(elem)
+        parser.feed(chunk)
+    parser.close()
+    for _, elem in parser.read_events():
+        yield from _entry_event(elem)
+
+
+def _entry_event(elem):
+    """
+    Turns a finished XML element into a feed entry if it is one, then releases the element.
+    """
+    name = _local_name(elem.tag)
+    if name in ("url", "sitemap", "item", "entry"):
+        entry = _parse_xml_entry(elem)
+        elem.clear()
+        if entry["link"]:
+            yield ("sitemap" if name == "sitemap" else "page"), entry
+
+
+def discover_recipes(
+    feed_url, url_pattern=None, sitemap_pattern=None, known=None, headers=None
+):
+    """
+    Discovers recipe URLs from a blog's XML sitemap (or sitemap index), RSS/Atom feed or JSON feed,
+    instead of crawling its listing pages. Sitemap indexes are followed recursively, reading each sitemap once.
+
+    Parameters:
+        feed_url (str): URL of the sitemap, sitemap index or feed.
+        url_pattern (str): Optional regex a URL must match to count as a recipe.
+        sitemap_pattern (str): Optional regex a child sitemap URL must match to be followed, e.g. "post".
+        known (dict): Optional link -> lastmod of the recipes scraped previously. Known recipes are only
+                      returned if their lastmod is newer, or if either lastmod is unknown.
+        headers (dict): Headers to include in requests.
+
+    Returns:
+        list: A list of dictionaries with "link", "lastmod" and, if the sitemap lists one, "image_url",
+              in the format expected by `parse_recipes`.
+    """
+    known = known or {}
+    recipes = []
+    seen = set()
+    feeds = [feed_url]
+    # Sitemap indexes may list themselves or each other; each feed is only read once
+    visited = {feed_url}
+    while feeds:
+        url = feeds.pop(0)
+        print(f"Reading {url}")
+        with timed("discovery"):
+            response = requests.get(url, headers=headers, stream=True)
+            increment("feeds_fetched")
+            if response.status_code != 200:
+                print(f"Failed to fetch {url}")
+                increment("feed_fetch_failures")
+                continue
+
+            try:
+                for kind, entry in iter_feed_entries(
+                    response.iter_content(chunk_size=65536)
+                ):
+                    link = entry["link"]
+                    if kind == "sitemap":
+                        if link not in visited and (
+                            not sitemap_pattern or re.search(sitemap_pattern, link)
+                        ):
+                            visited.add(link)
+                            feeds.append(link)
+                        continue
+
+                    if link in seen or (url_pattern and not re.search(url_pattern, link)):
+                        continue
+                    seen.add(link)
+                    increment("recipe_links_found")
+
+                    previous = known.get(link)
+                    if (
+                        link not in known
+                        or previous is None
+                        or entry["lastmod"] is None
+                        or entry["lastmod"] > previous
+                    ):
+                        recipes.append(entry)
+            except (ET.ParseError, json.JSONDecodeError) as e:
+                # E.g. an empty body or an error page served with status 200; the other feeds are still read
+                print(f"Failed to parse {url}: {e}")
+                increment("feed_parse_failures")
+            finally:
+                response.close()
+
+    print(f"Found {len(seen)} recipes, {len(recipes)} of them new or changed")
+    return recipes
+
+
+def load_lastmods(db_path):
+    """
+    Reads the link and last modification date of the recipes saved by a previous run, and of the posts
+    it rejected because they have no recipe (see `save_rejected_links`).
+
+    Parameters:
+        db_path (str): Path to the SQLite database written by a scraper.
+
+    Returns:
+        dict: link -> lastmod (None if unknown). Empty if the database does not exist yet.
+    """
+    if not os.path.exists(db_path):
+        return {}
+    conn = sqlite3.connect(db_path)
+    rows = []
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master")]
+    if "rejected_links" in tables:
+        rows += conn.execute("SELECT link, lastmod FROM rejected_links").fetchall()
+    if "recipes" in tables:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(recipes)")]
+        if "lastmod" in columns:
+            rows += conn.execute("SELECT link, lastmod FROM recipes").fetchall()
+        else:
+            rows += [(link, None) for (link,) in conn.execute("SELECT link FROM recipes")]
+    conn.close()
+    return dict(rows)
+
+
+def save_rejected_links(db_path, rejected):
+    """
+    Remembers the posts `parse_recipes` rejected because they have no recipe, together with their lastmod,
+    so that incremental runs only fetch them again once they change.
+
+    Parameters:
+        db_path (str): Path to the SQLite database written by a scraper.
+        rejected (list): Dictionaries with "link" and, if known, "lastmod" collected by `parse_recipes`.
+    """
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS rejected_links (link TEXT PRIMARY KEY, lastmod TEXT)"
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO rejected_links VALUES (?, ?)",
+        [(entry["link"], entry.get("lastmod")) for entry in rejected],
+    )
+    conn.commit()
+    conn.close()
+
+
+def merge_with_existing(df, db_path):
+    """
+    Combines newly parsed recipes with the recipes saved by a previous run, replacing the ones that were
+    fetched again, so that an incremental run still produces a complete database.
+
+    Parameters:
+        df (pd.DataFrame): The newly parsed recipes.
+        db_path (str): Path to the SQLite database written by a scraper.
+
+    Returns:
+        pd.DataFrame: The unchanged previous recipes followed by the new ones.
+    """
+    if not os.path.exists(db_path):
+        return df
+    conn = sqlite3.connect(db_path)
+    df_existing = pd.read_sql_query("SELECT * FROM recipes", conn)
+    conn.close()
+    if "link" in df.columns:
+        df_existing = df_existing[~df_existing["link"].isin(df["link"])]
+    return pd.concat([df_existing, df], ignore_index=True)
+
+
 def scrape_recipes(
     all_urls,
     recipe_card_selector=None,
@@ -61,33 +337,38 @@ def scrape_recipes(
     recipes = []
     for url in all_urls:
         print(f"Scraping {url}")
-        response = requests.get(url, headers=headers)
+        with timed("listing_fetch"):
+            response = requests.get(url, headers=headers)
+        increment("listing_pages_fetched")
         if response.status_code != 200:
             print(f"Failed to fetch {url}")
+            increment("listing_fetch_failures")
             continue
 
-        soup = BeautifulSoup(response.content, "html.parser")
-        recipe_cards = soup.select(recipe_card_selector)
-        for card in recipe_cards:
-            title_tag = card.select_one(title_selector)
-            title = title_tag.text.strip() if title_tag else "No title"
-            link_tag = title_tag.find("a") if title_tag else None
-            link = link_tag["href"] if link_tag else None
-
-            image_tag = card.select_one(image_selector)
-            image_url = (
-                image_tag[image_attr]
-                if image_tag and image_attr in image_tag.attrs
-                else None
-            )
-
-            recipes.append(
-                {
-                    "title": title,
-                    "link": link,
-                    "image_url": image_url,
-                }
-            )
+        with timed("listing_parse"):
+            soup = BeautifulSoup(response.content, "html.parser")
+            recipe_cards = soup.select(recipe_card_selector)
+            for card in recipe_cards:
+                title_tag = card.select_one(title_selector)
+                title = title_tag.text.strip() if title_tag else "No title"
+                link_tag = title_tag.find("a") if title_tag else None
+                link = link_tag["href"] if link_tag else None
+
+                image_tag = card.select_one(image_selector)
+                image_url = (
+                    image_tag[image_attr]
+                    if image_tag and image_attr in image_tag.attrs
+                    else None
+                )
+
+                recipes.append(
+                    {
+                        "title": title,
+                        "link": link,
+                        "image_url": image_url,
+                    }
+                )
+        increment("recipe_links_found", len(recipe_cards))
 
         print(f"Finished scraping {url}")
 
@@ -106,6 +387,7 @@ def parse_recipes(
     headers=None,
     check_recipe_exists=None,
     check_recipe_text=None,
+    rejected=None,
 ):
     """
     Parse detailed recipe information from a list of recipe URLs.
@@ -122,6 +404,7 @@ def parse_recipes(
         headers (dict): Optional headers for HTTP requests.
         check_recipe_exists (tuple): A tuple containing a selector to check if a recipe exists and optional expected text.
         check_recipe_text (str): Text to match if `check_recipe_exists` is not None.
+        rejected (list): Optional list to which the entries of pages without a recipe are appended.
 
     Returns:
         DataFrame: A Pandas DataFrame containing the parsed recipes.
@@ -132,75 +415,101 @@ def parse_recipes(
         url = current_recipe["link"]
         print(f"\rProgress: {i+1}/{len(recipes)}, URL: {url}", end="")
 
-        response = requests.get(url, headers=headers)
+        with timed("recipe_fetch"):
+            response = requests.get(url, headers=headers)
+        increment("recipe_pages_fetched")
         if response.status_code != 200:
             print(f"\nFailed to fetch {url}")
+            increment("recipe_fetch_failures")
             continue
 
-        soup = BeautifulSoup(response.content, "html.parser")
-
-        # Check if recipe exists
-        if check_recipe_exists:
-            exists_block = soup.select_one(check_recipe_exists[0])
-            if not exists_block or (
-                check_recipe_text and exists_block.text.strip() != check_recipe_text
-            ):
-                continue
-
-        # Extract Title
-        title_block = soup.select_one(title_selector)
-        if title_block:
-            current_recipe["title"] = title_block.text.strip()
-
-        # Extract Description
-        description_block = soup.select_one(description_selector)
-        if description_block:
-            current_recipe["description"] = description_block.text.strip()
-
-        # Extract Time
-        time_block = soup.select_one(time_selector)
-        if time_block:
-            time_list = time_block.text.strip().split()
-            if len(time_list) >= 4:  # Handle missing or short time strings
-                label = " ".join(time_list[0:2])
-                value = " ".join(time_list[2:4])
-                current_recipe[label] = value
-
-        # Extract Type of Food
-        type_food_block = soup.select_one(type_food_selector)
-        if type_food_block:
-            type_cards = type_food_block.select(".wprm-recipe-tag-container")
-            for card in type_cards:
-                label = card.select_one(".wprm-recipe-tag-label")
-                value = card.select_one(".wprm-block-text-normal")
-                if label and value:
-                    current_recipe[label.text.strip()] = value.text.strip()
-
-        # Extract Ingredients
-        ingredients = []
-        ingredient_cards = soup.select(ingredients_selector)
-        for card in ingredient_cards:
-            ingredient_block = card.select_one(".wprm-recipe-ingredient-name")
-            if ingredient_block:
-                ingredients.append(ingredient_block.text.strip())
-        current_recipe["ingredients"] = ingredients
-
-        # Extract Nutrition
-        nutrition_cards = soup.select(nutrition_selector)
-        for card in nutrition_cards:
-            label = card.select_one(".wprm-nutrition-label-text-nutrition-label")
-            value = card.select_one(".wprm-nutrition-label-text-nutrition-value")
-            unit = card.select_one(".wprm-nutrition-label-text-nutrition-unit")
-            if label and value and unit:
-                current_recipe[label.text.strip()] = (
-                    f"{value.text.strip()} {unit.text.strip()}"
-                )
-
-        # Extract Instructions
-        instructions_block = soup.select_one(instructions_selector)
-        if instructions_block:
-            current_recipe["instructions"] = instructions_block.text.strip()
+        with timed("recipe_parse"):
+            soup = BeautifulSoup(response.content, "html.parser")
+
+            # Check if recipe exists
+            if check_recipe_exists:
+                exists_block = soup.select_one(check_recipe_exists[0])
+                if not exists_block or (
+                    check_recipe_text and exists_block.text.strip() != check_recipe_text
+                ):
+                    if rejected is not None:
+                        rejected.append(current_recipe)
+                    continue
+
+            # Recipes discovered from feeds may come without an image
+            if not current_recipe.get("image_url"):
+                image_block = soup.select_one('meta[property="og:image"]')
+                if image_block:
+                    current_recipe["image_url"] = image_block.get("content")
+
+            # Extract Title
+            title_block = soup.select_one(title_selector)
+            if title_block:
+                current_recipe["title"] = title_block.text.strip()
+
+            # Extract Description
+            description_block = soup.select_one(description_selector)
+            if description_block:
+                current_recipe["description"] = description_block.text.strip()
+
+            # Extract Time
+            time_block = soup.select_one(time_selector)
+            if time_block:
+                time_list = time_block.text.strip().split()
+                if len(time_list) >= 4:  # Handle missing or short time strings
+                    label = " ".join(time_list[0:2])
+                    value = " ".join(time_list[2:4])
+                    current_recipe[label] = value
+
+            # Extract Type of Food
+            type_food_block = soup.select_one(type_food_selector)
+            if type_food_block:
+                type_cards = type_food_block.select(".wprm-recipe-tag-container")
+                for card in type_cards:
+                    label = card.select_one(".wprm-recipe-tag-label")
+                    value = card.select_one(".wprm-block-text-normal")
+                    if label and value:
+                        current_recipe[label.text.strip()] = value.text.strip()
+
+            # Extract Ingredients
+            ingredients = []
+            ingredient_cards = soup.select(ingredients_selector)
+            for card in ingredient_cards:
+                ingredient_block = card.select_one(".wprm-recipe-ingredient-name")
+                if ingredient_block:
+                    ingredients.append(ingredient_block.text.strip())
+            current_recipe["ingredients"] = ingredients
+
+            # Extract Nutrition
+            nutrition_cards = soup.select(nutrition_selector)
+            for card in nutrition_cards:
+                label = card.select_one(".wprm-nutrition-label-text-nutrition-label")
+                value = card.select_one(".wprm-nutrition-label-text-nutrition-value")
+                unit = card.select_one(".wprm-nutrition-label-text-nutrition-unit")
+                if label and value and unit:
+                    current_recipe[label.text.strip()] = (
+                        f"{value.text.strip()} {unit.text.strip()}"
+                    )
+                    # Typed copy with normalised units, e.g. "Calories:" -> "calories_kcal"
+                    number, normalised_unit = parse_quantity(
+                        f"{value.text.strip()} {unit.text.strip()}"
+                    )
+                    if number is not None:
+                        current_recipe[
+                            nutrition_column(label.text.strip(), normalised_unit)
+                        ] = number
+
+            # Extract numeric times and servings
+            for key in ["prep", "cook", "total"]:
+                current_recipe[f"{key}_time_minutes"] = extract_time_minutes(soup, key)
+            current_recipe["servings"] = extract_servings(soup)
+
+            # Extract Instructions
+            instructions_block = soup.select_one(instructions_selector)
+            if instructions_block:
+                current_recipe["instructions"] = instructions_block.text.strip()
 
         parsed_recipes.append(current_recipe)
+        increment("recipes_parsed")
 
     return pd.DataFrame(parsed_recipes)
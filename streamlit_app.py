@@ -1,9 +1,27 @@
 import sqlite3
 import streamlit as st
 import pandas as pd
-from utils import count_unique_vals
+from utils import dataset_version, ingredient_mask
+from substitutions import expand_pantry, load_substitution_graph
+from numeric_fields import range_conditions
+from precompute import load_precomputed, log_query, query_key
+from recipe_stats import get_statistics
+from instrumentation import (
+    collecting,
+    debug_params_allowed,
+    export_json,
+    export_prometheus,
+    increment,
+    is_enabled,
+    start_profiler,
+    stop_profiler,
+    timed,
+    write_metrics,
+)
 
 
+DB_PATH = "./data/standardised_recipes.db"
+
 # Define a list of common ingredients typically available at home
 COMMON_INGREDIENTS = [
     "Salt",
@@ -23,35 +41,139 @@ COMMON_INGREDIENTS = [
     "Garam Masala",
 ]
 
+# Catalogue rows matched in the first batch of `iter_filter_recipes`; later batches double in size
+FIRST_BATCH_SIZE = 1_000
+MAX_BATCH_SIZE = 64_000
+
+
+RECIPES_PER_ROW = 2
+
 
-def load_recipe_data(db_path="./data/standardised_recipes.db"):
+def load_recipe_data(db_path="./data/standardised_recipes.db", numeric_ranges=None):
     """
     Loads recipe data from an SQLite database and preprocesses the recipe DataFrame by converting specific columns to lists.
 
     Parameters:
         db_path (str): Path to the SQLite database.
+        numeric_ranges (dict): Optional column name -> (minimum, maximum) filters on the numeric columns,
+                               applied in SQL so they can use the column indexes.
 
     Returns:
         pd.DataFrame: DataFrame containing recipe data.
     """
-    conn = sqlite3.connect(db_path)
-    query = "SELECT * FROM recipes"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+    with timed("sqlite_load"):
+        conn = sqlite3.connect(db_path)
+        query = "SELECT * FROM recipes"
+        conditions, params = range_conditions(numeric_ranges or {})
+        conditions = [conditions] if conditions else []
+        # Skip the near-duplicates tagged by dedupe.py
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(recipes)")]
+        if "is_canonical" in columns:
+            conditions.append("is_canonical = 1")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        df = pd.read_sql_query(query, conn, params=params)
+        conn.close()
 
-    df["normalised_ingredients"] = df["normalised_ingredients"].apply(
-        lambda x: [ingredient.strip() for ingredient in x.split(";")]
-    )
-    df["course"] = df["course"].apply(
-        lambda x: [course.strip() for course in x.split(",")]
+    with timed("list_splitting"):
+        df["normalised_ingredients"] = df["normalised_ingredients"].apply(
+            lambda x: [ingredient.strip() for ingredient in x.split(";")]
+        )
+        df["course"] = df["course"].apply(
+            lambda x: [course.strip() for course in x.split(",")]
+        )
+        df["cuisine"] = df["cuisine"].apply(
+            lambda x: [cuisine.strip() for cuisine in x.split(",")]
+        )
+        df["ingredient_mask"] = df["normalised_ingredients"].apply(ingredient_mask)
+    increment("recipes_loaded", len(df))
+    return df
+
+
+def _match_recipes(
+    df,
+    cuisines,
+    courses,
+    max_time,
+    available_mask,
+    missing_count,
+    substitutions,
+    numeric_ranges,
+):
+    """
+    Splits the recipes matching the user criteria into those with all ingredients and those with
+    missing ingredients, given the bitmask of the (expanded) pantry.
+    """
+    if "ingredient_mask" in df.columns:
+        recipe_masks = df["ingredient_mask"]
+    else:
+        recipe_masks = df["normalised_ingredients"].apply(ingredient_mask)
+    missing = recipe_masks.apply(lambda mask: (mask & ~available_mask).bit_count())
+
+    matches_criteria = (
+        df["cuisine"].apply(lambda x: any(cuisine in x for cuisine in cuisines))
+        & df["course"].apply(lambda x: any(course in x for course in courses))
+        & (df["total_time_minutes"] <= max_time)
     )
-    df["cuisine"] = df["cuisine"].apply(
-        lambda x: [cuisine.strip() for cuisine in x.split(",")]
+    for column, (minimum, maximum) in (numeric_ranges or {}).items():
+        if minimum is not None:
+            matches_criteria &= df[column] >= minimum
+        if maximum is not None:
+            matches_criteria &= df[column] <= maximum
+    all_ingredients_df = df[matches_criteria & (missing == 0)]
+    missing_ingredients_df = df[
+        matches_criteria & (missing > 0) & (missing <= missing_count)
+    ]
+
+    if substitutions:
+        all_ingredients_df = annotate_substitutions(all_ingredients_df, substitutions)
+        missing_ingredients_df = annotate_substitutions(
+            missing_ingredients_df, substitutions
+        )
+
+    return all_ingredients_df, missing_ingredients_df
+
+
+def _available_mask(ingredients, substitution_graph):
+    """
+    Expands the pantry with its substitutes and builds its ingredient bitmask.
+
+    Returns:
+        tuple: The pantry bitmask and the substitutions from `expand_pantry`.
+    """
+    substitutions = (
+        expand_pantry(ingredients, substitution_graph) if substitution_graph else {}
     )
-    return df
+    return ingredient_mask(list(ingredients) + list(substitutions)), substitutions
 
 
-def filter_recipes(df, cuisines, courses, max_time, ingredients, missing_count):
+@st.cache_resource(show_spinner=False)
+def load_cached_recipe_data(db_path, version):
+    """
+    Loads the recipes once per dataset version and shares them between all sessions and reruns,
+    instead of reading and preprocessing the database on every interaction.
+
+    Parameters:
+        db_path (str): Path to the SQLite database.
+        version (str): The dataset version from `dataset_version`; only used as part of the cache key.
+
+    Returns:
+        pd.DataFrame: The output of `load_recipe_data`. It is shared, so it must not be modified.
+    """
+    return load_recipe_data(db_path)
+
+
+@timed("filter_recipes")
+def filter_recipes(
+    df,
+    cuisines,
+    courses,
+    max_time,
+    ingredients,
+    missing_count,
+    substitution_graph=None,
+    numeric_ranges=None,
+):
     """
     Filters the recipes based on user criteria.
 
@@ -62,33 +184,99 @@ def filter_recipes(df, cuisines, courses, max_time, ingredients, missing_count):
         max_time (int): Maximum cooking time in minutes.
         ingredients (list): Ingredients the user has at home.
         missing_count (int): Maximum number of missing ingredients.
+        substitution_graph (dict): Optional substitution graph. Recipe ingredients that can be replaced by
+                                   something in the pantry count as available, and the substitutions used
+                                   are reported in a "substitutions" column.
+        numeric_ranges (dict): Optional column name -> (minimum, maximum) filters on the numeric columns,
+                               e.g. {"calories_kcal": (None, 500)}. Either bound can be None.
 
     Returns:
         tuple: Two DataFrames (recipes with all ingredients, recipes with missing ingredients).
     """
-    all_ingredients_df = df[
-        df["cuisine"].apply(lambda x: any(cuisine in x for cuisine in cuisines))
-        & df["course"].apply(lambda x: any(course in x for course in courses))
-        & (df["total_time_minutes"] <= max_time)
-        & df["normalised_ingredients"].apply(
-            lambda ing: all(ingredient in ingredients for ingredient in ing)
-        )
-    ]
+    # Expanded once per query; each recipe is then matched with a single bitmask operation
+    available_mask, substitutions = _available_mask(ingredients, substitution_graph)
+    return _match_recipes(
+        df,
+        cuisines,
+        courses,
+        max_time,
+        available_mask,
+        missing_count,
+        substitutions,
+        numeric_ranges,
+    )
 
-    missing_ingredients_df = df[
-        df["cuisine"].apply(lambda x: any(cuisine in x for cuisine in cuisines))
-        & df["course"].apply(lambda x: any(course in x for course in courses))
-        & (df["total_time_minutes"] <= max_time)
-        & df["normalised_ingredients"].apply(
-            lambda ing: 0
-            < sum(1 for ingredient in ing if ingredient not in ingredients)
-            <= missing_count
-        )
-    ]
 
-    return all_ingredients_df, missing_ingredients_df
+def iter_filter_recipes(
+    df,
+    cuisines,
+    courses,
+    max_time,
+    ingredients,
+    missing_count,
+    substitution_graph=None,
+    numeric_ranges=None,
+    first_batch_size=FIRST_BATCH_SIZE,
+):
+    """
+    Filters the recipes like `filter_recipes`, but yields the results in batches as the catalogue is
+    scanned, so the first results can be shown before the whole catalogue has been matched.
 
+    The first batch covers `first_batch_size` recipes and every following batch twice as many (up to
+    MAX_BATCH_SIZE), which keeps the time to the first results short without adding much overhead on
+    large catalogues. Concatenating the batches gives exactly the result of `filter_recipes`.
 
+    Parameters:
+        See `filter_recipes`.
+        first_batch_size (int): Number of recipes matched for the first batch.
+
+    Yields:
+        tuple: Two DataFrames (recipes with all ingredients, recipes with missing ingredients) per batch.
+    """
+    available_mask, substitutions = _available_mask(ingredients, substitution_graph)
+
+    start, batch_size = 0, first_batch_size
+    while start < len(df):
+        with timed("filter_batch"):
+            batch = _match_recipes(
+                df.iloc[start : start + batch_size],
+                cuisines,
+                courses,
+                max_time,
+                available_mask,
+                missing_count,
+                substitutions,
+                numeric_ranges,
+            )
+        increment("filter_batches")
+        yield batch
+        start += batch_size
+        batch_size = min(batch_size * 2, MAX_BATCH_SIZE)
+
+
+def annotate_substitutions(df, substitutions):
+    """
+    Adds a "substitutions" column listing, for each recipe, the ingredients covered by a substitute.
+
+    Parameters:
+        df (pd.DataFrame): Recipes returned by `filter_recipes`.
+        substitutions (dict): Output of `expand_pantry` for the query.
+
+    Returns:
+        pd.DataFrame: The recipes with a "substitutions" column mapping ingredient -> substitute.
+    """
+    return df.assign(
+        substitutions=df["normalised_ingredients"].apply(
+            lambda ing: {
+                ingredient: substitutions[ingredient][0]
+                for ingredient in ing
+                if ingredient in substitutions
+            }
+        )
+    )
+
+
+@timed("render_recipes")
 def populate_recipes(df, ingredients, missing=False):
     """
     Displays recipes in a grid format, showing images and details.
@@ -98,7 +286,8 @@ def populate_recipes(df, ingredients, missing=False):
         ingredients (list): User-selected ingredients.
         missing (bool): Whether to display missing ingredients.
     """
-    num_recipes_per_row = 2
+    increment("recipes_rendered", len(df))
+    num_recipes_per_row = RECIPES_PER_ROW
     for i in range(0, len(df), num_recipes_per_row):
         cols = st.columns(num_recipes_per_row)
         for j, col in enumerate(cols):
@@ -114,25 +303,86 @@ def populate_recipes(df, ingredients, missing=False):
                         st.markdown(f"#### [{recipe['title']}]({recipe['link']})")
                         st.write(recipe["description"])
 
+                        substitutions = recipe.get("substitutions") or {}
+                        if substitutions:
+                            st.write(
+                                "Substitutions: "
+                                + ", ".join(
+                                    f"{substitute} for {ingredient}"
+                                    for ingredient, substitute in substitutions.items()
+                                )
+                            )
+
                         if missing:
                             missing_items = [
                                 item
-                                for item in recipe["normalised_ingredients"]
-                                if item not in ingredients
+                                for item in dict.fromkeys(recipe["normalised_ingredients"])
+                                if item not in ingredients and item not in substitutions
                             ]
                             st.write(f"Missing ingredients: {', '.join(missing_items)}")
 
 
-if __name__ == "__main__":
-    # Load and preprocess data
-    df_recipes = load_recipe_data()
-
-    # Extract unique values
-    unique_cuisine = list(count_unique_vals(df_recipes, "cuisine").keys())
-    unique_course = list(count_unique_vals(df_recipes, "course").keys())
-    unique_ingredients = list(
-        count_unique_vals(df_recipes, "normalised_ingredients").keys()
-    )
+def stream_recipes(batches, ingredients, missing_count):
+    """
+    Displays result batches in tabs as they arrive. The tabs are created with the first non-empty batch,
+    and each tab shows a progress note below its recipes until the last batch has been rendered.
+
+    Parameters:
+        batches (iterable): (recipes with all ingredients, recipes with missing ingredients) DataFrame
+                            tuples, e.g. from `iter_filter_recipes`.
+        ingredients (list): User-selected ingredients.
+        missing_count (int): Maximum number of missing ingredients. The tab with missing ingredients is
+                             only shown if it is above zero.
+    """
+    tab_names = ["Recipes with all ingredients available"]
+    if missing_count > 0:
+        tab_names.append("Recipes with missing ingredients")
+
+    grids, placeholders = None, None
+    # Recipes left over from the previous batch, held back so rows are always filled
+    pending = [None] * len(tab_names)
+    for batch in batches:
+        if grids is None:
+            if all(df.empty for df in batch[: len(tab_names)]):
+                continue
+            grids, placeholders = [], []
+            for tab in st.tabs(tab_names):
+                with tab:
+                    grids.append(st.container())
+                    placeholders.append(st.empty())
+                    placeholders[-1].caption("Searching for more recipes...")
+
+        for i, df in enumerate(batch[: len(tab_names)]):
+            if pending[i] is not None:
+                df = pd.concat([pending[i], df])
+            complete = len(df) - len(df) % RECIPES_PER_ROW
+            pending[i] = df.iloc[complete:]
+            if complete:
+                with grids[i]:
+                    populate_recipes(df.iloc[:complete], ingredients, missing=i > 0)
+
+    if grids is None:
+        return
+    for i, df in enumerate(pending):
+        if df is not None and not df.empty:
+            with grids[i]:
+                populate_recipes(df, ingredients, missing=i > 0)
+        placeholders[i].empty()
+
+
+def main():
+    """
+    Renders the app: the search and filter controls and the matching recipes.
+    """
+    # Load and preprocess data, once per dataset version
+    df_recipes = load_cached_recipe_data(DB_PATH, dataset_version(DB_PATH))
+
+    # Extract unique values, computed once per dataset version
+    with timed("vocabulary"):
+        frequencies = get_statistics(DB_PATH)["frequencies"]
+        unique_cuisine = list(frequencies["cuisine"].keys())
+        unique_course = list(frequencies["course"].keys())
+        unique_ingredients = list(frequencies["normalised_ingredients"].keys())
 
     # Set up Streamlit app
     st.set_page_config(layout="wide")
@@ -157,33 +407,95 @@ if __name__ == "__main__":
         missing_count = st.number_input(
             "Maximum number of missing ingredients:", min_value=0, max_value=5, step=1
         )
+        # The calorie filter is hidden if numeric_fields.py was not run or no recipe lists calories
+        calories = df_recipes.get("calories_kcal")
+        max_calories = None
+        if calories is not None and calories.max() > 0:
+            max_calories = int(calories.max())
+            selection_calories = st.slider(
+                "Calories [kcal]:", 0, max_calories, (0, max_calories)
+            )
         selection_ingredients = st.multiselect(
             "Input ingredients you have at home:",
             unique_ingredients,
             default=COMMON_INGREDIENTS,
         )
+        allow_substitutions = st.toggle(
+            "Allow ingredient substitutions (e.g. Oil for Butter)", value=True
+        )
+
+    # Only filter on calories once the range is narrowed, so recipes without nutrition info are kept
+    numeric_ranges = {}
+    if max_calories is not None and selection_calories != (0, max_calories):
+        numeric_ranges["calories_kcal"] = selection_calories
 
-    # Filter recipes
-    filtered_data, missing_data = filter_recipes(
-        df_recipes,
+    substitution_graph = load_substitution_graph() if allow_substitutions else None
+    key = query_key(
         selection_cuisine,
         selection_course,
         selection_time,
         selection_ingredients,
         missing_count,
+        allow_substitutions,
+        numeric_ranges,
     )
+    # Widget interactions that do not change the query (e.g. expanding a recipe) rerun the script too;
+    # only log a query when it differs from this session's previous one
+    if st.session_state.get("last_query_key") != key:
+        log_query(key)
+        st.session_state["last_query_key"] = key
+
+    # Serve precomputed results for the default and most frequent queries, otherwise stream the results
+    # while the catalogue is being matched
+    precomputed = load_precomputed(DB_PATH).get(key)
+    if precomputed is not None:
+        increment("precomputed_hits")
+        filtered_data, missing_data = (
+            df_recipes.iloc[positions] for positions in precomputed
+        )
+        if substitution_graph:
+            substitutions = expand_pantry(selection_ingredients, substitution_graph)
+            filtered_data = annotate_substitutions(filtered_data, substitutions)
+            missing_data = annotate_substitutions(missing_data, substitutions)
+        batches = [(filtered_data, missing_data)]
+    else:
+        batches = iter_filter_recipes(
+            df_recipes,
+            selection_cuisine,
+            selection_course,
+            selection_time,
+            selection_ingredients,
+            missing_count,
+            substitution_graph,
+            numeric_ranges,
+        )
 
     # Display tabs
-    if not filtered_data.empty or not missing_data.empty:
-        tab_names = ["Recipes with all ingredients available"]
-        if missing_count > 0:
-            tab_names.append("Recipes with missing ingredients")
-
-        tabs = st.tabs(tab_names)
-        for tab, name in zip(tabs, tab_names):
-            if name == "Recipes with all ingredients available":
-                with tab:
-                    populate_recipes(filtered_data, selection_ingredients)
-            else:
-                with tab:
-                    populate_recipes(missing_data, selection_ingredients, missing=True)
+    stream_recipes(batches, selection_ingredients, missing_count)
+
+
+if __name__ == "__main__":
+    # Opt-in instrumentation: ?metrics=1 collects and shows metrics for this session's run only
+    # (RECIPE_METRICS=1 collects them for the whole process), ?profile=1 profiles this single run.
+    # Both query parameters are ignored unless the operator sets RECIPE_DEBUG_PARAMS=1
+    debug_params = debug_params_allowed()
+    metrics_requested = debug_params and st.query_params.get("metrics") == "1"
+    profile_requested = debug_params and st.query_params.get("profile") == "1"
+    profiler = start_profiler() if profile_requested else None
+    try:
+        with collecting(metrics_requested):
+            main()
+            if is_enabled():
+                write_metrics()
+    finally:
+        # Also stop the profiler when Streamlit interrupts the run to rerun or stop the script
+        report = stop_profiler(profiler) if profiler is not None else None
+
+    if report is not None:
+        with st.expander("Profile"):
+            st.code(report)
+
+    if metrics_requested:
+        with st.expander("Metrics"):
+            st.code(export_prometheus())
+            st.download_button("Download as JSON", export_json(), "metrics.json")
@@ -0,0 +1,189 @@
+import heapq
+import json
+import re
+import sqlite3
+from collections import Counter, defaultdict
+
+from instrumentation import timed
+
+
+CURATED_SUBSTITUTIONS_PATH = "./data/curated_substitutions.json"
+SUBSTITUTION_GRAPH_PATH = "./data/substitution_graph.json"
+
+# Cost of a substitution mined from "X or Y" alternatives in the scraped recipes
+MINED_SUBSTITUTION_COST = 1.0
+
+# Mined pairs seen fewer times than this are recipe-specific (e.g. "crushed peanuts or sesame seeds")
+# and are only used if they are also listed in the curated substitutions
+MIN_MINED_OCCURRENCES = 2
+
+# Substitution chains costing more than this are not offered
+MAX_SUBSTITUTION_COST = 2.0
+
+
+def mine_substitutions(db_path="./data/standardised_recipes.db"):
+    """
+    Mines substitutions from the standardisation mappings. Recipe authors often list alternatives such as
+    "ghee or oil"; when the alternatives standardise to different ingredients, they can replace each other.
+
+    Parameters:
+        db_path (str): Path to the SQLite database with raw and standardised ingredients.
+
+    Returns:
+        Counter: The number of times each (ingredient, substitute) pair was seen. Pairs are symmetric.
+    """
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT ingredients, normalised_ingredients FROM recipes"
+    ).fetchall()
+    conn.close()
+
+    # Map each raw ingredient name to the standardised name it was most often given
+    raw_to_standard = defaultdict(Counter)
+    for raw, standardised in rows:
+        if not raw or not standardised:
+            continue
+        raw_list = [item.strip().lower() for item in raw.split(";")]
+        standardised_list = [item.strip() for item in standardised.split(";")]
+        # Both lists are stored in the same order; skip rows where they do not line up
+        if len(raw_list) != len(standardised_list):
+            continue
+        for raw_item, standardised_item in zip(raw_list, standardised_list):
+            raw_to_standard[raw_item][standardised_item] += 1
+
+    pairs = Counter()
+    for raw_item in raw_to_standard:
+        if " or " not in raw_item:
+            continue
+        alternatives = [alt.strip() for alt in re.split(r"\s+or\s+", raw_item)]
+        standardised = list(
+            dict.fromkeys(
+                raw_to_standard[alt].most_common(1)[0][0]
+                for alt in alternatives
+                if alt in raw_to_standard
+            )
+        )
+        for ingredient in standardised:
+            for substitute in standardised:
+                if ingredient != substitute:
+                    pairs[(ingredient, substitute)] += 1
+    return pairs
+
+
+def _cheapest_paths(edges, ingredient, max_cost):
+    """
+    Finds the cheapest substitution chain from an ingredient to every substitute within max_cost (Dijkstra).
+    """
+    costs = {}
+    queue = [(0.0, ingredient)]
+    while queue:
+        cost, current = heapq.heappop(queue)
+        if current in costs:
+            continue
+        costs[current] = cost
+        for substitute, edge_cost in edges.get(current, {}).items():
+            if substitute not in costs and cost + edge_cost <= max_cost:
+                heapq.heappush(queue, (cost + edge_cost, substitute))
+    del costs[ingredient]
+    return costs
+
+
+def build_substitution_graph(
+    db_path="./data/standardised_recipes.db",
+    curated_path=CURATED_SUBSTITUTIONS_PATH,
+    max_cost=MAX_SUBSTITUTION_COST,
+    min_occurrences=MIN_MINED_OCCURRENCES,
+):
+    """
+    Builds the substitution graph from curated and mined substitutions.
+
+    Only the curated substitutions are closed transitively, so that a lookup never needs to walk
+    substitution chains. Mined substitutions only hold for the recipes they were listed in, so they are
+    added as direct substitutions and never chained, and only if they were seen at least `min_occurrences`
+    times. Curated entries take precedence over mined ones; a curated cost of null removes a mined substitution.
+
+    Parameters:
+        db_path (str): Path to the SQLite database used to mine substitutions.
+        curated_path (str): Path to a JSON file mapping ingredient -> {substitute: cost}.
+        max_cost (float): Maximum total cost of a substitution chain.
+        min_occurrences (int): Minimum number of times a mined substitution must have been seen.
+
+    Returns:
+        dict: ingredient -> {substitute: cheapest total cost}.
+    """
+    with open(curated_path) as f:
+        curated = json.load(f)
+    edges = defaultdict(dict)
+    reviewed = set()
+    for ingredient, substitutes in curated.items():
+        for substitute, cost in substitutes.items():
+            reviewed.add((ingredient, substitute))
+            if cost is not None:
+                edges[ingredient][substitute] = cost
+
+    graph = {}
+    for ingredient in edges:
+        costs = _cheapest_paths(edges, ingredient, max_cost)
+        if costs:
+            graph[ingredient] = costs
+
+    for (ingredient, substitute), count in mine_substitutions(db_path).items():
+        if count < min_occurrences or (ingredient, substitute) in reviewed:
+            continue
+        costs = graph.setdefault(ingredient, {})
+        costs[substitute] = min(
+            costs.get(substitute, MINED_SUBSTITUTION_COST), MINED_SUBSTITUTION_COST
+        )
+    return graph
+
+
+def load_substitution_graph(path=SUBSTITUTION_GRAPH_PATH):
+    """
+    Loads a substitution graph precomputed with `build_substitution_graph`.
+
+    Parameters:
+        path (str): Path to the JSON file.
+
+    Returns:
+        dict: ingredient -> {substitute: cost}.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+@timed("expand_pantry")
+def expand_pantry(ingredients, graph):
+    """
+    Finds every ingredient that is not in the pantry but can be replaced by something that is.
+    This is computed once per query, so matching a recipe is a single set or bitmask operation.
+
+    Parameters:
+        ingredients (list): Ingredients the user has at home.
+        graph (dict): Substitution graph from `build_substitution_graph`.
+
+    Returns:
+        dict: ingredient -> (substitute in the pantry, cost), using the cheapest substitute.
+    """
+    pantry = set(ingredients)
+    substitutions = {}
+    for ingredient, substitutes in graph.items():
+        if ingredient in pantry:
+            continue
+        available = [
+            (cost, substitute)
+            for substitute, cost in substitutes.items()
+            if substitute in pantry
+        ]
+        if available:
+            cost, substitute = min(available)
+            substitutions[ingredient] = (substitute, cost)
+    return substitutions
+
+
+if __name__ == "__main__":
+    substitution_graph = build_substitution_graph()
+    with open(SUBSTITUTION_GRAPH_PATH, "w") as f:
+        json.dump(substitution_graph, f, indent=2, sort_keys=True)
+    print(
+        f"Saved substitutions for {len(substitution_graph)} ingredients to {SUBSTITUTION_GRAPH_PATH}"
+    )
@@ -0,0 +1,120 @@
+import functools
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from scraping_utils import discover_recipes, load_lastmods, save_rejected_links
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "feeds")
+RECIPE_PATTERN = r"^https://blog\.example/[^/?#]+/$"
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def feed_server(tmp_path_factory):
+    """
+    Serves the fixture feeds from a local HTTP server. The fixtures refer to each other through a {base}
+    placeholder, which is replaced by the server's URL.
+    """
+    directory = tmp_path_factory.mktemp("feeds")
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(directory))
+    )
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    for name in os.listdir(FIXTURES_DIR):
+        with open(os.path.join(FIXTURES_DIR, name)) as f:
+            content = f.read()
+        (directory / name).write_text(content.replace("{base}", base))
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield base
+    server.shutdown()
+    server.server_close()
+
+
+def test_discovers_recipes_from_sitemap_index(feed_server):
+    # The empty and the non-XML post sitemaps come first and must not stop discovery
+    recipes = discover_recipes(
+        f"{feed_server}/sitemap_index.xml",
+        url_pattern=RECIPE_PATTERN,
+        sitemap_pattern="post",
+    )
+
+    assert recipes == [
+        {
+            "link": "https://blog.example/pad-thai/",
+            "lastmod": "2024-05-01T06:30:00+00:00",
+            "image_url": "https://blog.example/images/pad-thai.jpg",
+        },
+        {
+            "link": "https://blog.example/green-curry/",
+            "lastmod": "2024-01-15T12:00:00+00:00",
+        },
+    ]
+
+
+def test_only_returns_new_or_changed_recipes(feed_server):
+    known = {
+        "https://blog.example/pad-thai/": "2024-05-01T06:30:00+00:00",
+        "https://blog.example/green-curry/": "2023-12-01T00:00:00+00:00",
+    }
+    recipes = discover_recipes(
+        f"{feed_server}/sitemap_index.xml",
+        url_pattern=RECIPE_PATTERN,
+        sitemap_pattern="post",
+        known=known,
+    )
+
+    assert [recipe["link"] for recipe in recipes] == ["https://blog.example/green-curry/"]
+
+
+def test_reads_rss_feed(feed_server):
+    recipes = discover_recipes(f"{feed_server}/rss.xml")
+
+    assert recipes == [
+        {"link": "https://blog.example/pad-thai/", "lastmod": "2024-05-01T06:30:00+00:00"}
+    ]
+
+
+def test_rejected_links_are_skipped_until_they_change(feed_server, tmp_path):
+    db_path = str(tmp_path / "recipes.db")
+    save_rejected_links(
+        db_path,
+        [{"link": "https://blog.example/pad-thai/", "lastmod": "2024-05-01T06:30:00+00:00"}],
+    )
+
+    recipes = discover_recipes(
+        f"{feed_server}/sitemap_index.xml",
+        url_pattern=RECIPE_PATTERN,
+        sitemap_pattern="post",
+        known=load_lastmods(db_path),
+    )
+
+    assert [recipe["link"] for recipe in recipes] == ["https://blog.example/green-curry/"]
+
+
+def test_sitemap_index_loops_are_read_once(feed_server, capsys):
+    # loop.xml lists itself and loop-b.xml, which lists loop.xml again
+    recipes = discover_recipes(f"{feed_server}/loop.xml", url_pattern=RECIPE_PATTERN)
+
+    assert [recipe["link"] for recipe in recipes] == [
+        "https://blog.example/pad-thai/",
+        "https://blog.example/green-curry/",
+    ]
+    reads = [line for line in capsys.readouterr().out.splitlines() if line.startswith("Reading")]
+    assert reads == [
+        f"Reading {feed_server}/loop.xml",
+        f"Reading {feed_server}/loop-b.xml",
+        f"Reading {feed_server}/post-sitemap.xml",
+    ]
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from streamlit_app import filter_recipes, iter_filter_recipes, load_recipe_data
+from substitutions import load_substitution_graph
+
+
+@pytest.fixture(scope="module")
+def recipes():
+    return load_recipe_data(os.path.join(ROOT, "data", "standardised_recipes.db"))
+
+
+@pytest.mark.parametrize("substitutions", [False, True])
+def test_batches_concatenate_to_filter_recipes(recipes, substitutions):
+    graph = (
+        load_substitution_graph(os.path.join(ROOT, "data", "substitution_graph.json"))
+        if substitutions
+        else None
+    )
+    # A pantry of the most common ingredients, so both result sets are non-empty
+    pantry = recipes["normalised_ingredients"].explode().value_counts().index[:60].tolist()
+    query = (
+        ["Thai", "Japanese", "Korean"],
+        ["Main Course", "Side Dish", "Appetizer"],
+        60,
+        pantry,
+        3,
+        graph,
+    )
+
+    expected = filter_recipes(recipes, *query)
+    # A small first batch, so the catalogue is split into many batches of growing size
+    batches = list(iter_filter_recipes(recipes, *query, first_batch_size=7))
+
+    assert len(batches) > 5
+    for position, expected_df in enumerate(expected):
+        assert not expected_df.empty
+        pd.testing.assert_frame_equal(
+            pd.concat([batch[position] for batch in batches]), expected_df
+        )
@@ -0,0 +1,65 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from recipe_stats import compute_statistics, get_statistics
+from utils import dataset_version
+
+
+ROWS = [
+    ("Rice; Salt", "Thai", "Main"),
+    ("Noodles; Soy Sauce", "Chinese", "Main, Side"),
+    ("Rice; Fish Sauce", "Thai", "Side"),
+    ("Chili Pepper; Salt", "Chinese", "Main"),
+]
+
+
+def make_database(path):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE recipes (normalised_ingredients TEXT, cuisine TEXT, course TEXT)"
+    )
+    conn.executemany("INSERT INTO recipes VALUES (?, ?, ?)", ROWS)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_vocabularies_keep_first_appearance_order(tmp_path):
+    db_path = make_database(str(tmp_path / "recipes.db"))
+
+    # The first chunk mixes cuisines, and the order must also survive merging the second chunk
+    stats = compute_statistics(db_path, chunk_size=3, processes=1, co_occurrence=False)
+
+    assert list(stats["frequencies"]["normalised_ingredients"].items()) == [
+        ("Rice", 2),
+        ("Salt", 2),
+        ("Noodles", 1),
+        ("Soy Sauce", 1),
+        ("Fish Sauce", 1),
+        ("Chili Pepper", 1),
+    ]
+    assert list(stats["frequencies"]["course"]) == ["Main", "Side"]
+
+
+def test_corrupt_cache_is_recomputed(tmp_path):
+    db_path = make_database(str(tmp_path / "recipes.db"))
+    cache_path = tmp_path / "stats.json"
+    cache_path.write_text('{"dataset_version": "')
+
+    stats = get_statistics(db_path, str(cache_path))
+
+    assert stats["recipes"] == 4
+    assert dataset_version(db_path) in cache_path.read_text()
+
+
+def test_cache_without_statistics_is_recomputed(tmp_path):
+    db_path = make_database(str(tmp_path / "recipes.db"))
+    cache_path = tmp_path / "stats.json"
+    cache_path.write_text('{"dataset_version": "%s"}' % dataset_version(db_path))
+
+    assert get_statistics(db_path, str(cache_path))["recipes"] == 4
+    # The cache is rewritten in place, without leaving temporary files behind
+    assert sorted(os.listdir(tmp_path)) == ["recipes.db", "stats.json"]
@@ -0,0 +1,107 @@
+import json
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from streamlit_app import filter_recipes
+from substitutions import build_substitution_graph, expand_pantry
+
+
+GRAPH = {
+    "Butter": {"Oil": 1.0, "Ghee": 0.5},
+    "Broth": {"Stock": 0.5},
+}
+
+
+def make_recipes(rows):
+    """
+    Builds a recipe DataFrame in the shape returned by `load_recipe_data`, from (name, ingredients) pairs.
+    """
+    return pd.DataFrame(
+        {
+            "recipe_name": [name for name, _ in rows],
+            "normalised_ingredients": [ingredients for _, ingredients in rows],
+            "cuisine": [["Thai"]] * len(rows),
+            "course": [["Main"]] * len(rows),
+            "total_time_minutes": [30] * len(rows),
+        }
+    )
+
+
+def make_database(path, ingredients):
+    """
+    Creates a recipe database with the given (raw, standardised) ingredient lists, for mining substitutions.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE recipes (ingredients TEXT, normalised_ingredients TEXT)")
+    conn.executemany("INSERT INTO recipes VALUES (?, ?)", ingredients)
+    conn.commit()
+    conn.close()
+
+
+def test_expand_pantry_uses_cheapest_substitute():
+    assert expand_pantry(["Oil", "Ghee"], GRAPH) == {"Butter": ("Ghee", 0.5)}
+
+
+def test_expand_pantry_skips_ingredients_already_in_pantry():
+    assert expand_pantry(["Butter", "Oil"], GRAPH) == {}
+
+
+def test_substitute_covers_ingredient():
+    df = make_recipes([("Butter Noodles", ["Noodles", "Butter"])])
+
+    without_graph, _ = filter_recipes(df, ["Thai"], ["Main"], 60, ["Noodles", "Oil"], 0)
+    with_graph, _ = filter_recipes(
+        df, ["Thai"], ["Main"], 60, ["Noodles", "Oil"], 0, substitution_graph=GRAPH
+    )
+
+    assert without_graph.empty
+    assert with_graph["recipe_name"].tolist() == ["Butter Noodles"]
+    assert with_graph["substitutions"].tolist() == [{"Butter": "Oil"}]
+
+
+def test_curated_null_blocks_mined_substitution(tmp_path):
+    db_path = str(tmp_path / "recipes.db")
+    # "ghee or oil" and "oil or ghee" are two separate mentions of the pair, enough for it to be mined
+    make_database(
+        db_path,
+        [
+            ("ghee or oil; rice", "Ghee; Rice"),
+            ("oil or ghee; salt", "Oil; Salt"),
+            ("ghee", "Ghee"),
+            ("oil", "Oil"),
+        ],
+    )
+    curated_path = tmp_path / "curated.json"
+    curated_path.write_text(json.dumps({}))
+    blocked_path = tmp_path / "blocked.json"
+    blocked_path.write_text(json.dumps({"Ghee": {"Oil": None}}))
+
+    mined = build_substitution_graph(db_path, str(curated_path))
+    blocked = build_substitution_graph(db_path, str(blocked_path))
+
+    assert mined["Ghee"] == {"Oil": 1.0}
+    assert "Ghee" not in blocked
+    # The null only removes the reviewed direction
+    assert blocked["Oil"] == {"Ghee": 1.0}
+    assert expand_pantry(["Oil"], blocked) == {}
+
+
+def test_repeated_ingredients_count_once():
+    df = make_recipes(
+        [
+            ("Salted Rice", ["Rice", "Salt", "Salt"]),
+            ("Salted Butter Rice", ["Rice", "Salt", "Salt", "Butter"]),
+        ]
+    )
+
+    all_ingredients, missing_ingredients = filter_recipes(
+        df, ["Thai"], ["Main"], 60, ["Rice"], 1
+    )
+
+    assert all_ingredients.empty
+    assert missing_ingredients["recipe_name"].tolist() == ["Salted Rice"]
@@ -1,7 +1,21 @@
+import hashlib
+import os
 import re
+import threading
 from collections import Counter
 
+from instrumentation import timed
 
+
+# Bit position assigned to each ingredient, shared by all DataFrames so masks stay comparable
+_ingredient_bits = {}
+_ingredient_bits_lock = threading.Lock()
+
+# Dataset versions by (path, size, modification time), so files are only hashed when they change
+_dataset_versions = {}
+
+
+@timed("find_unique_vals")
 def find_unique_vals(df, column_name):
     """
     Finds all unique words in a column, regardless of the entries being lists of words.
@@ -89,6 +103,7 @@ def clean_ingredient(ingredient):
     return re.sub(r"[^a-zA-Z\s]", "", ingredient).strip()
 
 
+@timed("count_unique_vals")
 def count_unique_vals(df, column_name):
     """
     Counts the unique values in a specified column of a DataFrame, where each entry in the column is a list of items.
@@ -105,16 +120,13 @@ def count_unique_vals(df, column_name):
         >>> count_unique_vals(df, "ingredients")
         Counter({"apple": 2, "banana": 2, "carrot": 1})
     """
-    # Flatten all words into a single list
-    all_ingredients = [
+    # Count occurrences of each unique ingredient, streaming over the rows instead of flattening them into a list
+    ingredient_counts = Counter(
         ingredient.strip()  # Strip any extra spaces from ingredients
         for ingredients in df[column_name]  # Iterate over the rows in the column
         for ingredient in ingredients  # Iterate over each ingredient in the list
         if ingredient is not None  # Skip None values
-    ]
-
-    # Count occurrences of each unique ingredient
-    ingredient_counts = Counter(all_ingredients)
+    )
 
     return ingredient_counts
 
@@ -163,3 +175,51 @@ def convert_to_minutes_extended(time_str):
 
     # Convert to total minutes
     return days * 1440 + hours * 60 + minutes  # 1 day = 1440 minutes
+
+
+def ingredient_mask(ingredients):
+    """
+    Encodes a collection of ingredients as an integer bitmask, with one bit per distinct ingredient.
+    Checking which of a recipe's ingredients are missing from a pantry then reduces to `recipe & ~pantry`.
+
+    Parameters:
+        ingredients (iterable): Ingredient names.
+
+    Returns:
+        int: The bitmask of the ingredients.
+
+    Example:
+        >>> missing = ingredient_mask(["Salt", "Butter"]) & ~ingredient_mask(["Salt"])
+        >>> missing.bit_count()
+        1
+    """
+    mask = 0
+    for ingredient in ingredients:
+        bit = _ingredient_bits.get(ingredient)
+        if bit is None:
+            with _ingredient_bits_lock:
+                bit = _ingredient_bits.setdefault(ingredient, len(_ingredient_bits))
+        mask |= 1 << bit
+    return mask
+
+
+def dataset_version(path):
+    """
+    Identifies a snapshot of a dataset by the hash of its contents, so derived data (precomputed results,
+    statistics) can be stored with the version it was computed from and ignored once the data changes.
+
+    Parameters:
+        path (str): Path to the dataset file, e.g. the SQLite database.
+
+    Returns:
+        str: The SHA-256 hex digest of the file.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _dataset_versions:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _dataset_versions[key] = digest.hexdigest()
+    return _dataset_versions[key]